@@ -0,0 +1,77 @@
+"""
+Functions for streaming multiple QuerySets as a single ZIP archive.
+
+The archive is written to a non-seekable buffer, so each member uses a
+trailing data descriptor (rather than seeking back to fill in the local
+header), which means the archive can be streamed as it is generated.
+Each member CSV is written incrementally by the usual writers, so memory
+use stays bounded regardless of the total size of the archive.
+
+>>> members = [
+...     ("users.csv", User.objects.all(), ("first_name", "last_name")),
+...     ("groups.csv", Group.objects.all(), ("name",)),
+... ]
+>>> response = StreamingHttpResponse(stream_csv_archive(members))
+
+"""
+
+import io
+import zipfile
+from typing import Any, Dict, Generator, Iterable, Optional, Sequence, Tuple, Type
+
+from django.db.models import QuerySet
+
+from . import settings as app_settings
+from .columns import Column
+from .csv import (
+    BaseQuerySetWriter,
+    ChunkBuffer,
+    RowQuerySetWriter,
+    drain_batches,
+    iter_write_csv,
+)
+
+# (name, queryset, columns) for each CSV in the archive
+ArchiveMember = Tuple[str, QuerySet, Sequence[Column]]
+
+
+def stream_csv_archive(
+    members: Iterable[ArchiveMember],
+    *,
+    chunk_size: Optional[int] = None,
+    compression: int = zipfile.ZIP_DEFLATED,
+    writer_klass: Type[BaseQuerySetWriter] = RowQuerySetWriter,
+    **kwargs: Any,
+) -> Generator[bytes, None, Dict[str, int]]:
+    """
+    Yield a ZIP archive containing one CSV per member, in chunks.
+
+    The kwargs are passed through to `iter_write_csv` for each member.
+    Returns a dict mapping each member name to its row count.
+
+    """
+    chunk_size = chunk_size or app_settings.DEFAULT_CHUNK_SIZE
+    sink = ChunkBuffer()
+    row_counts: Dict[str, int] = {}
+    with zipfile.ZipFile(sink, mode="w", compression=compression) as archive:
+        for name, queryset, columns in members:
+            # member size is unknown up front, so always allow for zip64
+            with io.TextIOWrapper(
+                archive.open(name, mode="w", force_zip64=True),
+                encoding="utf-8",
+                newline="",
+                write_through=True,
+            ) as fileobj:
+                row_counts[name] = yield from drain_batches(
+                    iter_write_csv(
+                        fileobj,
+                        queryset,
+                        *columns,
+                        writer_klass=writer_klass,
+                        **kwargs,
+                    ),
+                    sink,
+                    chunk_size,
+                )
+    yield sink.drain()
+    return row_counts
@@ -0,0 +1,89 @@
+"""
+Incremental checksums of exported files.
+
+Checksums are calculated over the encoded bytes as they are written, so
+there is no need to re-read the file afterwards.
+
+>>> with open("users.csv", "wb") as f:
+...     fileobj = ChecksumWriter(f)
+...     with io.TextIOWrapper(fileobj, encoding="utf-8", newline="") as buffer:
+...         write_csv(buffer, queryset, *columns)
+>>> fileobj.checksum.sha256
+'5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8'
+
+"""
+
+import base64
+import hashlib
+import io
+from typing import Any, Dict
+
+
+class Checksum:
+    """MD5 / SHA-256 digests, and size, of the bytes it has been fed."""
+
+    def __init__(self) -> None:
+        # MD5 is used for integrity checks (e.g. Content-MD5) - not security
+        self._md5 = hashlib.md5()  # noqa: S324
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data: bytes) -> None:
+        self._md5.update(data)
+        self._sha256.update(data)
+        self.size += len(data)
+
+    @property
+    def md5(self) -> str:
+        """Return hex-encoded MD5 digest."""
+        return self._md5.hexdigest()
+
+    @property
+    def sha256(self) -> str:
+        """Return hex-encoded SHA-256 digest."""
+        return self._sha256.hexdigest()
+
+    @property
+    def content_md5(self) -> str:
+        """Return base64-encoded MD5 digest, as used by Content-MD5."""
+        return base64.b64encode(self._md5.digest()).decode()
+
+    @property
+    def checksum_sha256(self) -> str:
+        """Return base64-encoded SHA-256 digest, as used by S3 checksums."""
+        return base64.b64encode(self._sha256.digest()).decode()
+
+    def as_fields(self) -> Dict[str, Any]:
+        """Return the CsvDownload fields to record."""
+        return {"md5": self.md5, "sha256": self.sha256, "byte_count": self.size}
+
+
+class ChecksumWriter(io.RawIOBase):
+    """
+    Binary stream that updates a Checksum as it writes to fileobj.
+
+    Closing the stream does not close the underlying fileobj.
+
+    """
+
+    # there is no name, but TextIOWrapper expects one
+    name = ""
+
+    def __init__(self, fileobj: Any) -> None:
+        super().__init__()
+        self.fileobj = fileobj
+        self.checksum = Checksum()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self.fileobj.write(data)
+        self.checksum.update(data)
+        return len(data)
+
+
+def get_checksum(fileobj: Any) -> Checksum:
+    """Return the Checksum of a text fileobj wrapping a ChecksumWriter."""
+    return fileobj.buffer.checksum
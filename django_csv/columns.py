@@ -0,0 +1,190 @@
+"""
+Column specs for values that a plain `values_list` field can't express.
+
+A column can be a field name (as passed to `values_list`), or one of:
+
+`AnnotationColumn` - a query expression, added to the queryset with
+`annotate`, so it is calculated by the database in the same query.
+
+`BatchColumn` - a value fetched for a whole batch of rows at once. The
+writer collects the keys (e.g. pks) of each batch of rows it fetches, runs
+one query per BatchColumn for those keys, and merges the results into the
+rows before writing them - so the number of queries grows with the number
+of batches, not the number of rows.
+
+>>> columns = (
+...     "username",
+...     AnnotationColumn("order_count", Count("orders")),
+...     BatchColumn.lookup(
+...         "last_device", Login.objects.order_by("timestamp"), "user", "device"
+...     ),
+... )
+>>> write_csv(fileobj, User.objects.all(), *columns)
+
+"""
+
+from typing import Any, Callable, Dict, List, Mapping, Sequence, Union
+
+from django.db.models import QuerySet
+
+# function that returns {key: value} for a sequence of keys
+FetchFunction = Callable[[Sequence[Any]], Mapping[Any, Any]]
+
+
+class AnnotationColumn:
+    """Column calculated by the database, using a query expression."""
+
+    def __init__(self, name: str, expression: Any) -> None:
+        self.name = name
+        self.expression = expression
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class BatchColumn:
+    """
+    Column whose values are fetched for each batch of rows at once.
+
+    `fetch` is called with the distinct values of the `key` field for each
+    batch, and returns a {key: value} mapping. Rows whose key is missing
+    from the mapping get `default`.
+
+    """
+
+    def __init__(
+        self, name: str, fetch: FetchFunction, key: str = "pk", default: Any = None
+    ) -> None:
+        self.name = name
+        self.fetch = fetch
+        self.key = key
+        self.default = default
+
+    def __str__(self) -> str:
+        return self.name
+
+    @classmethod
+    def lookup(
+        cls,
+        name: str,
+        queryset: QuerySet,
+        related_field: str,
+        value_field: str,
+        key: str = "pk",
+        default: Any = None,
+    ) -> "BatchColumn":
+        """
+        Return a BatchColumn that looks up value_field in a related queryset.
+
+        Runs one `{related_field}__in` query per batch. If there is more than
+        one related row per key the last one wins, so order the queryset
+        accordingly (e.g. by timestamp to get the latest).
+
+        """
+
+        def fetch(keys: Sequence[Any]) -> Dict[Any, Any]:
+            return dict(
+                queryset.filter(**{f"{related_field}__in": keys}).values_list(
+                    related_field, value_field
+                )
+            )
+
+        return cls(name, fetch, key=key, default=default)
+
+    @classmethod
+    def aggregate(
+        cls,
+        name: str,
+        queryset: QuerySet,
+        related_field: str,
+        aggregate: Any,
+        key: str = "pk",
+        default: Any = None,
+    ) -> "BatchColumn":
+        """
+        Return a BatchColumn that aggregates a related queryset, per key.
+
+        Runs one `{related_field}__in` query per batch, grouped by the
+        related field - e.g. `aggregate("orders", Order.objects.all(),
+        "user", Count("id"), default=0)`.
+
+        """
+
+        def fetch(keys: Sequence[Any]) -> Dict[Any, Any]:
+            return dict(
+                queryset.filter(**{f"{related_field}__in": keys})
+                .order_by()
+                .values(related_field)
+                .annotate(_value=aggregate)
+                .values_list(related_field, "_value")
+            )
+
+        return cls(name, fetch, key=key, default=default)
+
+
+Column = Union[str, AnnotationColumn, BatchColumn]
+
+
+def column_names(columns: Sequence[Column]) -> List[str]:
+    """Return the names of the columns (used as the default header)."""
+    return [str(column) for column in columns]
+
+
+class ColumnPlan:
+    """
+    How to fetch a set of columns.
+
+    `fields` are the names passed to `values_list` - the field names and
+    annotations, followed by any BatchColumn keys not already included -
+    and `resolve` turns a batch of those rows into rows of column values.
+
+    """
+
+    def __init__(self, columns: Sequence[Column]) -> None:
+        self.columns = columns
+        self.names = column_names(columns)
+        self.annotations = {
+            c.name: c.expression for c in columns if isinstance(c, AnnotationColumn)
+        }
+        self.batch_columns = [c for c in columns if isinstance(c, BatchColumn)]
+        self.fields = [
+            name
+            for column, name in zip(columns, self.names)
+            if not isinstance(column, BatchColumn)
+        ]
+        keys = (c.key for c in self.batch_columns if c.key not in self.fields)
+        self.fields += list(dict.fromkeys(keys))
+        self.index = {field: i for i, field in enumerate(self.fields)}
+
+    def values_list(self, queryset: QuerySet, *extra_fields: str) -> QuerySet:
+        """
+        Return queryset as a values_list of the plan's fields.
+
+        Any extra_fields come first, and must be stripped from the rows
+        before they are passed to `resolve`.
+
+        """
+        if self.annotations:
+            queryset = queryset.annotate(**self.annotations)
+        return queryset.values_list(*extra_fields, *self.fields)
+
+    def resolve(self, rows: Sequence[tuple]) -> Sequence[tuple]:
+        """Return a batch of values_list rows as rows of column values."""
+        if not (self.batch_columns and rows):
+            return rows
+        fetched = {
+            column.name: column.fetch(
+                list(dict.fromkeys(row[self.index[column.key]] for row in rows))
+            )
+            for column in self.batch_columns
+        }
+        return [
+            tuple(self._value(row, column, fetched) for column in self.columns)
+            for row in rows
+        ]
+
+    def _value(self, row: tuple, column: Column, fetched: Dict[str, Mapping]) -> Any:
+        if isinstance(column, BatchColumn):
+            key = row[self.index[column.key]]
+            return fetched[column.name].get(key, column.default)
+        return row[self.index[str(column)]]
@@ -28,16 +28,23 @@ Example of writing to an in-memory text buffer:
     >>> csv.write_csv(buffer, qs, *cols)
     10
 
+Example of streaming to a StreamingHttpResponse:
+
+    >>> response = StreamingHttpResponse(csv.stream_csv(qs, *cols))
+
 """
 
-import csv
+import io
 import logging
-from typing import Any, Sequence, Type
+from itertools import islice
+from typing import Any, Generator, Iterator, Optional, Sequence, Type
 
-from django.core.paginator import Paginator
 from django.db.models import QuerySet
+from django.utils.module_loading import import_string
 
-from .settings import DEFAULT_PAGE_SIZE, MAX_ROWS
+from . import db, settings as app_settings
+from .columns import Column, ColumnPlan
+from .encoders import BaseRowEncoder, ProfilingEncoder
 from .types import OptionalSequence
 
 logger = logging.getLogger(__name__)
@@ -50,92 +57,340 @@ class BaseQuerySetWriter:
     Do not use this class directly - use one of the subclasses, based
     on your expected use case - data size, memory constraints etc.
 
-    This class wraps the csv.writerow and csv.writerows functions, and
-    maps queryset columns to CSV fields (via `values_list`). It is
+    This class wraps a row encoder (see `encoders`) - by default one that
+    uses the csv.writerow and csv.writerows functions - and maps queryset
+    columns to CSV fields (via `values_list`). Columns can also be
+    AnnotationColumn / BatchColumn specs (see `columns`). It is
     initialised with a 'csvfile' where "csvfile can be any object with
     a write() method."
 
     See https://docs.python.org/3/library/csv.html#csv.writer
 
+    If `using` is set the queryset is run against that database alias
+    (e.g. a read replica), falling back to CSV_DOWNLOAD_DB_ALIAS - if
+    neither is set the database router decides. `max_rows` defaults to
+    CSV_DOWNLOAD_MAX_ROWS.
+
+    `encoder_klass` defaults to CSV_DOWNLOAD_ENCODER, and if `profile`
+    (default CSV_DOWNLOAD_PROFILE) is set the encoder is wrapped in a
+    ProfilingEncoder, whose stats are dumped when the writer is closed.
+
     """
 
     def __init__(
-        self, csvfile: Any, queryset: QuerySet, *columns: str, max_rows: int = MAX_ROWS
+        self,
+        csvfile: Any,
+        queryset: QuerySet,
+        *columns: Column,
+        max_rows: Optional[int] = None,
+        using: Optional[str] = None,
+        encoder_klass: Optional[Type[BaseRowEncoder]] = None,
+        profile: Optional[bool] = None,
     ) -> None:
-        self.writer = csv.writer(csvfile)
-        self.queryset = queryset
+        using = using or app_settings.EXPORT_DB_ALIAS
+        encoder_klass = encoder_klass or import_string(app_settings.ENCODER)
+        self.writer: BaseRowEncoder = encoder_klass(csvfile)
+        if app_settings.PROFILE if profile is None else profile:
+            self.writer = ProfilingEncoder(self.writer)
+        self.queryset = queryset.using(using) if using else queryset
         self.columns = columns
-        self.max_rows = max_rows
+        self.plan = ColumnPlan(columns)
+        self.max_rows: int = app_settings.MAX_ROWS if max_rows is None else max_rows
 
     def rows(self) -> QuerySet:
         """Return the rows to write as a capped values_list queryset."""
-        return self.queryset.values_list(*self.columns)[: self.max_rows]
+        return self.plan.values_list(self.queryset)[: self.max_rows]
 
     def write_header(self, column_headers: OptionalSequence = None) -> None:
-        row: Sequence = self.columns
+        row: Sequence = self.plan.names
         if column_headers:
             if len(column_headers) != len(self.columns):
                 raise ValueError("Columns and headers do not match in length.")
             row = column_headers
         self.writer.writerow(row)
 
-    def write_rows(self) -> int:
+    def write_batches(self) -> Iterator[int]:
+        """
+        Write the rows out, yielding the number of rows in each batch.
+
+        Yielding between batches allows the caller to do something with
+        the output written so far (e.g. stream it) before the next batch
+        is written.
+
+        """
         raise NotImplementedError
 
+    def write_rows(self) -> int:
+        """Write all the rows out and return the number of rows written."""
+        return sum(self.write_batches())
+
+    def close(self) -> None:
+        """Close the encoder, once everything has been written."""
+        self.writer.close()
+
 
 class BulkQuerySetWriter(BaseQuerySetWriter):
-    """Subclass of QuerySetWriter that writes out queryset in one go."""
+    """Subclass of QuerySetWriter that writes out queryset in a single query."""
 
-    def write_rows(self) -> int:
-        """Write the rows out in one go."""
-        self.writer.writerows(rows := self.rows())
-        return rows.count()
+    def __init__(
+        self, *args: Any, batch_size: Optional[int] = None, **kwargs: Any
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.batch_size: int = batch_size or app_settings.DEFAULT_BATCH_SIZE
+
+    def write_batches(self) -> Iterator[int]:
+        """Write the rows out in batches, from a single query."""
+        # The rows are fetched from the cursor batch_size at a time (using a
+        # server-side cursor where the backend supports it) rather than being
+        # loaded into the queryset's result cache, and each batch is released
+        # once it has been written - so memory is bounded by the batch size,
+        # not the size of the queryset. The row count is the sum of the batches.
+        rows = self.rows().iterator(chunk_size=self.batch_size)
+        while batch := list(islice(rows, self.batch_size)):
+            self.writer.writerows(self.plan.resolve(batch))
+            yield len(batch)
 
 
 class PagedQuerySetWriter(BaseQuerySetWriter):
     """Subclass of QuerySetWriter that writes out queryset in pages."""
 
-    def __init__(self, *args: Any, page_size: int = DEFAULT_PAGE_SIZE, **kwargs: Any):
+    def __init__(
+        self, *args: Any, page_size: Optional[int] = None, **kwargs: Any
+    ) -> None:
         super().__init__(*args, **kwargs)
-        self.page_size = page_size
+        self.page_size: int = page_size or app_settings.DEFAULT_PAGE_SIZE
 
-    def write_rows(self) -> int:
+    def write_batches(self) -> Iterator[int]:
         """Write the rows out in pages."""
-        paginator = Paginator(rows := self.rows(), self.page_size)
-        for page_number in paginator.page_range:
-            self.writer.writerows(paginator.page(page_number).object_list)
-        return rows.count()
+        # Pages are sliced off until a short page is returned, rather than using
+        # a Paginator, as that would run a COUNT(*) query up front.
+        rows = self.rows()
+        for offset in range(0, self.max_rows, self.page_size):
+            page = list(rows[offset : offset + self.page_size])
+            if page:
+                self.writer.writerows(self.plan.resolve(page))
+                yield len(page)
+            if len(page) < self.page_size:
+                break
+
+
+class KeysetQuerySetWriter(PagedQuerySetWriter):
+    """
+    Subclass of QuerySetWriter that writes out queryset in pages, by pk.
+
+    Rows are written in pk order, and each pk must appear in at most one
+    row - columns that span to-many relations (which repeat the pk) will
+    lose rows at page boundaries. The pk of the last row written is kept
+    as `last_pk`, and passing it back in as `start_after` carries on from
+    where the writer left off.
+
+    """
+
+    def __init__(self, *args: Any, start_after: Any = None, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.last_pk = start_after
+
+    def rows(self) -> QuerySet:
+        """Return the rows after last_pk, in pk order, with the pk prepended."""
+        # the queryset's own ordering is replaced, as pages are keyed on the pk
+        queryset = self.queryset.order_by("pk")
+        if self.last_pk is not None:
+            queryset = queryset.filter(pk__gt=self.last_pk)
+        return self.plan.values_list(queryset, "pk")
+
+    def write_batches(self) -> Iterator[int]:
+        """Write the rows out in pages, each starting after the last pk."""
+        # Each page is "WHERE pk > last_pk ORDER BY pk LIMIT page_size", which
+        # walks the pk index - unlike OFFSET pages, later pages cost no more
+        # than the first, and rows are never loaded as model instances.
+        remaining = self.max_rows
+        while remaining > 0:
+            page = list(self.rows()[: min(self.page_size, remaining)])
+            if page:
+                self.last_pk = page[-1][0]
+                self.writer.writerows(self.plan.resolve([row[1:] for row in page]))
+                yield len(page)
+            if len(page) < self.page_size:
+                break
+            remaining -= len(page)
 
 
 class RowQuerySetWriter(BaseQuerySetWriter):
     """Subclass of QuerySetWriter that writes out queryset row-by-row."""
 
-    def write_rows(self) -> int:
+    def write_batches(self) -> Iterator[int]:
         """Write the rows out one-by-one."""
         # Since using an iterator means the querysets result-cache is not populated,
         # a call to .count() will cause a new database hit, which can be very expensive
-        # for large querysets. It's more efficient to use a manual counter here.
-        row_count = 0
-        for row in self.rows().iterator():
+        # for large querysets. Each row is yielded as a batch of one, and the caller
+        # sums them up instead.
+        rows = self.rows().iterator()
+        if self.plan.batch_columns:
+            # batch columns are fetched for a chunk of rows at a time, so the
+            # rows are written in chunks too, rather than one-by-one
+            while chunk := list(islice(rows, app_settings.DEFAULT_BATCH_SIZE)):
+                self.writer.writerows(self.plan.resolve(chunk))
+                yield len(chunk)
+            return
+        for row in rows:
             self.writer.writerow(row)
-            row_count += 1
-        return row_count
+            yield 1
+
+
+class ChunkBuffer(io.RawIOBase):
+    """
+    Write-only binary buffer that can be drained as it fills up.
+
+    This is used as the sink for streamed output - bytes written to it
+    are held until the caller calls `drain`, which returns (and releases)
+    everything written so far.
+
+    """
+
+    # there is no underlying file, but TextIOWrapper expects a name
+    name = ""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.chunks: list = []
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        """Return everything written since the last drain."""
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        self.size = 0
+        return data
+
+
+def iter_write_csv(
+    fileobj: Any,
+    queryset: QuerySet,
+    *columns: Column,
+    header: bool = True,
+    max_rows: Optional[int] = None,
+    column_headers: OptionalSequence = None,
+    writer_klass: Type[BaseQuerySetWriter] = BulkQuerySetWriter,
+    using: Optional[str] = None,
+    statement_timeout: Optional[int] = None,
+    **writer_kwargs: Any,
+) -> Generator[int, None, int]:
+    """
+    Write QuerySet to fileobj in CSV format, yielding after each batch.
+
+    This is the incremental version of `write_csv` - it yields the number
+    of rows in each batch as it is written, and returns the total row
+    count when exhausted.
+
+    """
+    writer = writer_klass(
+        fileobj, queryset, *columns, max_rows=max_rows, using=using, **writer_kwargs
+    )
+    if header:
+        writer.write_header(column_headers=column_headers)
+    if statement_timeout is None:
+        statement_timeout = app_settings.STATEMENT_TIMEOUT
+    row_count = 0
+    with db.statement_timeout(writer.queryset.db, statement_timeout):
+        for batch_count in writer.write_batches():
+            row_count += batch_count
+            yield batch_count
+    writer.close()
+    return row_count
 
 
 def write_csv(
     fileobj: Any,
     queryset: QuerySet,
-    *columns: str,
+    *columns: Column,
     header: bool = True,
-    max_rows: int = MAX_ROWS,
+    max_rows: Optional[int] = None,
     column_headers: OptionalSequence = None,
     writer_klass: Type[BaseQuerySetWriter] = BulkQuerySetWriter,
+    using: Optional[str] = None,
+    statement_timeout: Optional[int] = None,
     **writer_kwargs: Any,
 ) -> int:
-    """Write QuerySet to fileobj in CSV format using BulkQuerySetWriter."""
+    """
+    Write QuerySet to fileobj in CSV format using BulkQuerySetWriter.
+
+    The queryset is run against the `using` database alias (if set), with
+    the `statement_timeout` (in milliseconds) applied on backends that
+    support it. Both default to their CSV_DOWNLOAD_* settings - pass
+    `statement_timeout=0` to disable a configured timeout.
+
+    """
     writer = writer_klass(
-        fileobj, queryset, *columns, max_rows=max_rows, **writer_kwargs
+        fileobj, queryset, *columns, max_rows=max_rows, using=using, **writer_kwargs
     )
     if header:
         writer.write_header(column_headers=column_headers)
-    return writer.write_rows()
+    if statement_timeout is None:
+        statement_timeout = app_settings.STATEMENT_TIMEOUT
+    with db.statement_timeout(writer.queryset.db, statement_timeout):
+        row_count = writer.write_rows()
+    writer.close()
+    return row_count
+
+
+def drain_batches(
+    batches: Generator[int, None, int], sink: ChunkBuffer, chunk_size: int
+) -> Generator[bytes, None, int]:
+    """
+    Run the batches from `iter_write_csv`, draining the sink as it fills up.
+
+    Yields the contents of the sink each time it holds at least chunk_size
+    bytes, and returns the row count. Anything left in the sink at the end
+    is left for the caller to drain.
+
+    """
+    while True:
+        try:
+            next(batches)
+        except StopIteration as ex:
+            return ex.value
+        if sink.size >= chunk_size:
+            yield sink.drain()
+
+
+def stream_csv(
+    queryset: QuerySet,
+    *columns: Column,
+    chunk_size: Optional[int] = None,
+    writer_klass: Type[BaseQuerySetWriter] = RowQuerySetWriter,
+    **kwargs: Any,
+) -> Generator[bytes, None, int]:
+    """
+    Yield QuerySet as utf-8 encoded CSV chunks, returning the row count.
+
+    Output is buffered until at least `chunk_size` bytes have been
+    written, so memory use is bounded by the chunk size (plus one batch
+    of rows) rather than the size of the queryset. Takes the same kwargs
+    as `write_csv`.
+
+    >>> response = StreamingHttpResponse(stream_csv(qs, *cols))
+
+    """
+    chunk_size = chunk_size or app_settings.DEFAULT_CHUNK_SIZE
+    sink = ChunkBuffer()
+    with io.TextIOWrapper(
+        sink, encoding="utf-8", newline="", write_through=True
+    ) as fileobj:
+        row_count = yield from drain_batches(
+            iter_write_csv(
+                fileobj, queryset, *columns, writer_klass=writer_klass, **kwargs
+            ),
+            sink,
+            chunk_size,
+        )
+    if sink.size:
+        yield sink.drain()
+    return row_count
@@ -0,0 +1,60 @@
+"""Database helpers used to protect the database from export queries."""
+
+import contextlib
+import logging
+from typing import Generator, Optional
+
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def statement_timeout(
+    using: str, timeout: Optional[int]
+) -> Generator[None, None, None]:
+    """
+    Apply a statement timeout (in milliseconds) for the duration of the block.
+
+    On PostgreSQL the timeout is set with `SET LOCAL` semantics, so the
+    block is run inside a transaction (which server-side cursors require
+    anyway), and the previous timeout is restored afterwards - if the block
+    is nested in an outer transaction (e.g. ATOMIC_REQUESTS) the setting
+    would otherwise last until the outer transaction ends. On MySQL /
+    MariaDB the session timeout is set, and restored afterwards. On other
+    backends this is a no-op.
+
+    """
+    if not timeout:
+        yield
+        return
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        sql = "SELECT set_config('statement_timeout', %s, true)"
+        with transaction.atomic(using=using):
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT current_setting('statement_timeout')")
+                (previous,) = cursor.fetchone()
+                cursor.execute(sql, [str(timeout)])
+            yield
+            # on error the savepoint / transaction rollback restores it
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [previous])
+        return
+    if connection.vendor == "mysql":
+        if connection.mysql_is_mariadb:
+            variable, value = "max_statement_time", timeout / 1000
+        else:
+            variable, value = "max_execution_time", timeout
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT @@SESSION.{variable}")  # noqa: S608
+            (previous,) = cursor.fetchone()
+            cursor.execute(f"SET SESSION {variable} = %s", [value])
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SET SESSION {variable} = %s", [previous])
+        return
+    logger.debug("Statement timeout is not supported by %s", connection.vendor)
+    yield
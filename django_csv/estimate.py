@@ -0,0 +1,114 @@
+"""
+Functions used to estimate the size of an export before running it.
+
+Counting the rows in a large table can be almost as expensive as the
+export itself, so on PostgreSQL the row count is taken from the query
+planner statistics (via `EXPLAIN`), and elsewhere an exact count is run
+that is bounded by `limit` (so at most limit + 1 rows are counted).
+
+The size in bytes is estimated from the average width of a sample of
+encoded rows.
+
+>>> estimate = estimate_export(queryset, *columns, max_rows=10000)
+>>> estimate.truncated
+True
+
+"""
+
+import csv
+import io
+import json
+import logging
+from typing import NamedTuple, Optional, Tuple
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections
+from django.db.models import QuerySet
+
+from . import settings as app_settings
+from .columns import Column, ColumnPlan
+
+logger = logging.getLogger(__name__)
+
+
+class Estimate(NamedTuple):
+    """Estimated size of an export."""
+
+    # estimated number of rows in the queryset (before max_rows is applied)
+    rows: int
+    # estimated size of the CSV output, in bytes (after max_rows is applied)
+    bytes: int
+    # True if rows is an exact count (it may still be capped at limit + 1)
+    exact: bool
+    # the max_rows the estimate was made against
+    max_rows: int
+
+    @property
+    def truncated(self) -> bool:
+        """Return True if the export will be truncated at max_rows."""
+        return self.rows > self.max_rows
+
+
+def _explain_rows(queryset: QuerySet) -> int:
+    """Return the planner row estimate for the queryset (PostgreSQL only)."""
+    # compiled for the connection the EXPLAIN runs on, not the default alias
+    sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def estimate_rows(queryset: QuerySet, limit: Optional[int] = None) -> Tuple[int, bool]:
+    """
+    Return (rows, exact) estimate of the number of rows in the queryset.
+
+    On PostgreSQL this uses the planner estimate - which is not exact, but
+    does not touch the table. On other backends the count is exact, but
+    is bounded by limit - any count over limit is returned as limit + 1.
+
+    """
+    if connections[queryset.db].vendor == "postgresql":
+        try:
+            return _explain_rows(queryset), False
+        except EmptyResultSet:
+            # e.g. queryset.none() - there is no query to explain
+            return 0, True
+    if limit is None:
+        return queryset.count(), True
+    return queryset[: limit + 1].count(), True
+
+
+def estimate_row_width(
+    queryset: QuerySet, *columns: Column, sample_size: Optional[int] = None
+) -> float:
+    """Return the average width (in bytes) of a sample of encoded CSV rows."""
+    sample_size = sample_size or app_settings.ESTIMATE_SAMPLE_SIZE
+    plan = ColumnPlan(columns)
+    sample = list(plan.values_list(queryset)[:sample_size])
+    if not sample:
+        return 0.0
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(plan.resolve(sample))
+    return len(buffer.getvalue().encode("utf-8")) / len(sample)
+
+
+def estimate_export(
+    queryset: QuerySet,
+    *columns: Column,
+    max_rows: Optional[int] = None,
+    sample_size: Optional[int] = None,
+) -> Estimate:
+    """Return the estimated size of exporting the queryset as CSV."""
+    if max_rows is None:
+        max_rows = app_settings.MAX_ROWS
+    rows, exact = estimate_rows(queryset, limit=max_rows)
+    width = estimate_row_width(queryset, *columns, sample_size=sample_size)
+    return Estimate(
+        rows=rows,
+        bytes=int(width * min(rows, max_rows)),
+        exact=exact,
+        max_rows=max_rows,
+    )
@@ -0,0 +1,53 @@
+"""
+Add new CsvDownloads to the daily usage rollups (see `django_csv.rollup`).
+
+Only downloads created since the last run (past the watermark) are read,
+so this is cheap to run frequently, e.g. every few minutes from cron.
+
+"""
+
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from django_csv.rollup import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_PENDING_TIMEOUT,
+    DEFAULT_SETTLE_TIME,
+    rollup_downloads,
+)
+
+
+class Command(BaseCommand):
+    help = "Add new CSV downloads to the daily usage rollups."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=DEFAULT_BATCH_SIZE,
+            help="Number of downloads rolled up per transaction.",
+        )
+        parser.add_argument(
+            "--settle-time",
+            type=int,
+            default=DEFAULT_SETTLE_TIME,
+            help="Leave downloads newer than this (in seconds) for the next run.",
+        )
+        parser.add_argument(
+            "--pending-timeout",
+            type=int,
+            default=DEFAULT_PENDING_TIMEOUT,
+            help=(
+                "Stop waiting for resumable exports whose checkpoint is older "
+                "than this (in seconds)."
+            ),
+        )
+
+    def handle(self, *args: Any, **options: Any) -> None:
+        count = rollup_downloads(
+            batch_size=options["batch_size"],
+            settle_time=options["settle_time"],
+            pending_timeout=options["pending_timeout"],
+        )
+        self.stdout.write(f"Rolled up {count} downloads.")
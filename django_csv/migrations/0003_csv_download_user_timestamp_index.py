@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:27
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_csv", "0002_swap_csv_download_columns_field_to_textfield"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="csvdownload",
+            index=models.Index(
+                fields=["user", "timestamp"], name="csv_download_user_ts"
+            ),
+        ),
+    ]
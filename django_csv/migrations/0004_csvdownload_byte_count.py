@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_csv", "0003_csv_download_user_timestamp_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="csvdownload",
+            name="byte_count",
+            field=models.BigIntegerField(
+                blank=True, help_text="Size of the file, in bytes", null=True
+            ),
+        ),
+    ]
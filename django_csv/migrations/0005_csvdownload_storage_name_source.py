@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_csv", "0004_csvdownload_byte_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="csvdownload",
+            name="source",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="The stored export this is a re-download of",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="redownloads",
+                to="django_csv.csvdownload",
+            ),
+        ),
+        migrations.AddField(
+            model_name="csvdownload",
+            name="storage_name",
+            field=models.CharField(
+                blank=True,
+                help_text="Name of the stored file, for exports written to storage",
+                max_length=255,
+            ),
+        ),
+    ]
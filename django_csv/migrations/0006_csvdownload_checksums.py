@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_csv", "0005_csvdownload_storage_name_source"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="csvdownload",
+            name="md5",
+            field=models.CharField(
+                blank=True, help_text="MD5 checksum of the file", max_length=32
+            ),
+        ),
+        migrations.AddField(
+            model_name="csvdownload",
+            name="sha256",
+            field=models.CharField(
+                blank=True, help_text="SHA-256 checksum of the file", max_length=64
+            ),
+        ),
+    ]
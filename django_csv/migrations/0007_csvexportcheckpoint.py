@@ -0,0 +1,86 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:44
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_csv", "0006_csvdownload_checksums"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CsvExportCheckpoint",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "destination",
+                    models.CharField(
+                        help_text="Where the export is being written (without password)",
+                        max_length=255,
+                    ),
+                ),
+                (
+                    "last_pk",
+                    models.JSONField(
+                        blank=True,
+                        encoder=django.core.serializers.json.DjangoJSONEncoder,
+                        help_text="The pk of the last row written",
+                        null=True,
+                    ),
+                ),
+                ("row_count", models.IntegerField(default=0, help_text="Rows written")),
+                (
+                    "byte_count",
+                    models.BigIntegerField(default=0, help_text="Bytes written"),
+                ),
+                (
+                    "upload_id",
+                    models.CharField(
+                        blank=True, help_text="S3 multipart upload id", max_length=1024
+                    ),
+                ),
+                (
+                    "parts",
+                    models.JSONField(
+                        blank=True, default=list, help_text="S3 parts uploaded so far"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True, help_text="When the checkpoint was last saved"
+                    ),
+                ),
+                (
+                    "completed_at",
+                    models.DateTimeField(
+                        blank=True, help_text="When the export completed", null=True
+                    ),
+                ),
+                (
+                    "download",
+                    models.OneToOneField(
+                        help_text="The export being checkpointed",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="checkpoint",
+                        to="django_csv.csvdownload",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "CSV Export Checkpoint",
+            },
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_csv", "0007_csvexportcheckpoint"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CsvDownloadRollupWatermark",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "last_download_id",
+                    models.BigIntegerField(
+                        default=0, help_text="The pk of the last CsvDownload rolled up"
+                    ),
+                ),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        auto_now=True, help_text="When the rollups were last updated"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "CSV Download Rollup Watermark",
+            },
+        ),
+        migrations.CreateModel(
+            name="CsvDownloadRollup",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(help_text="Day of the downloads")),
+                ("filename", models.CharField(max_length=100)),
+                (
+                    "download_count",
+                    models.IntegerField(default=0, help_text="Downloads"),
+                ),
+                (
+                    "row_count",
+                    models.BigIntegerField(default=0, help_text="Rows downloaded"),
+                ),
+                (
+                    "byte_count",
+                    models.BigIntegerField(
+                        default=0, help_text="Bytes downloaded (where recorded)"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        help_text="User who initiated the downloads",
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "CSV Download Rollup",
+                "indexes": [
+                    models.Index(fields=["user", "date"], name="csv_rollup_user_date"),
+                    models.Index(
+                        fields=["filename", "date"], name="csv_rollup_filename_date"
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("date", "user", "filename"), name="csv_rollup_unique"
+                    )
+                ],
+            },
+        ),
+    ]
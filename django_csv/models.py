@@ -1,4 +1,7 @@
+from typing import Any
+
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils.translation import gettext_lazy as _lazy
 
@@ -19,12 +22,154 @@ class CsvDownload(models.Model):
     row_count = models.IntegerField(
         null=True, blank=True, help_text=_lazy("Rows downloaded")
     )
+    byte_count = models.BigIntegerField(
+        null=True, blank=True, help_text=_lazy("Size of the file, in bytes")
+    )
+    md5 = models.CharField(
+        max_length=32, blank=True, help_text=_lazy("MD5 checksum of the file")
+    )
+    sha256 = models.CharField(
+        max_length=64, blank=True, help_text=_lazy("SHA-256 checksum of the file")
+    )
     columns = models.TextField(
         help_text=_lazy("The list of source columns included in the download"),
     )
+    storage_name = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text=_lazy("Name of the stored file, for exports written to storage"),
+    )
+    source = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="redownloads",
+        help_text=_lazy("The stored export this is a re-download of"),
+    )
 
     class Meta:
         verbose_name = "CSV Download"
+        indexes = [
+            # used to check row quotas
+            models.Index(fields=["user", "timestamp"], name="csv_download_user_ts"),
+        ]
 
     def __str__(self) -> str:
         return f"{self.filename}"
+
+    def record_redownload(
+        self, user: settings.AUTH_USER_MODEL, **fields: Any
+    ) -> "CsvDownload":
+        """Record a download of this stored export by user, linked via source."""
+        return CsvDownload.objects.create(
+            **{
+                "user": user,
+                "filename": self.filename,
+                "row_count": self.row_count,
+                "byte_count": self.byte_count,
+                "md5": self.md5,
+                "sha256": self.sha256,
+                "columns": self.columns,
+                "storage_name": self.storage_name,
+                "source_id": self.source_id or self.pk,
+                **fields,
+            }
+        )
+
+
+class CsvExportCheckpoint(models.Model):
+    """Progress of a resumable export, used to restart it where it stopped."""
+
+    download = models.OneToOneField(
+        CsvDownload,
+        on_delete=models.CASCADE,
+        related_name="checkpoint",
+        help_text=_lazy("The export being checkpointed"),
+    )
+    destination = models.CharField(
+        max_length=255,
+        help_text=_lazy("Where the export is being written (without password)"),
+    )
+    last_pk = models.JSONField(
+        null=True,
+        blank=True,
+        encoder=DjangoJSONEncoder,
+        help_text=_lazy("The pk of the last row written"),
+    )
+    row_count = models.IntegerField(default=0, help_text=_lazy("Rows written"))
+    byte_count = models.BigIntegerField(default=0, help_text=_lazy("Bytes written"))
+    upload_id = models.CharField(
+        max_length=1024, blank=True, help_text=_lazy("S3 multipart upload id")
+    )
+    parts = models.JSONField(
+        default=list, blank=True, help_text=_lazy("S3 parts uploaded so far")
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True, help_text=_lazy("When the checkpoint was last saved")
+    )
+    completed_at = models.DateTimeField(
+        null=True, blank=True, help_text=_lazy("When the export completed")
+    )
+
+    class Meta:
+        verbose_name = "CSV Export Checkpoint"
+
+    def __str__(self) -> str:
+        return f"{self.download} ({self.row_count} rows)"
+
+    @property
+    def is_complete(self) -> bool:
+        return self.completed_at is not None
+
+
+class CsvDownloadRollup(models.Model):
+    """Daily totals of CSV downloads, per user and filename."""
+
+    date = models.DateField(help_text=_lazy("Day of the downloads"))
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        help_text=_lazy("User who initiated the downloads"),
+    )
+    filename = models.CharField(max_length=100)
+    download_count = models.IntegerField(default=0, help_text=_lazy("Downloads"))
+    row_count = models.BigIntegerField(default=0, help_text=_lazy("Rows downloaded"))
+    byte_count = models.BigIntegerField(
+        default=0, help_text=_lazy("Bytes downloaded (where recorded)")
+    )
+
+    class Meta:
+        verbose_name = "CSV Download Rollup"
+        constraints = [
+            # also the index used for date range queries
+            models.UniqueConstraint(
+                fields=["date", "user", "filename"], name="csv_rollup_unique"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "date"], name="csv_rollup_user_date"),
+            models.Index(fields=["filename", "date"], name="csv_rollup_filename_date"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.date}: {self.filename}"
+
+
+class CsvDownloadRollupWatermark(models.Model):
+    """The last CsvDownload added to the rollups (a single row)."""
+
+    last_download_id = models.BigIntegerField(
+        default=0, help_text=_lazy("The pk of the last CsvDownload rolled up")
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True, help_text=_lazy("When the rollups were last updated")
+    )
+
+    class Meta:
+        verbose_name = "CSV Download Rollup Watermark"
+
+    def __str__(self) -> str:
+        return f"{self.last_download_id}"
@@ -0,0 +1,331 @@
+"""
+Resumable exports to S3 / SFTP.
+
+Long-running exports are written with KeysetQuerySetWriter (in pk order),
+and progress is checkpointed to a CsvExportCheckpoint as the output is
+committed to the destination - the last pk written, the row and byte
+counts, and (for S3) the multipart upload id and the parts uploaded so
+far. If the export dies part way through, calling `write_csv_resumable`
+again with the same download picks up from the last checkpoint - the S3
+multipart upload is continued from the next part, and the SFTP file is
+truncated to the last checkpointed offset and appended to.
+
+>>> download = write_csv_resumable("s3://bucket/users.csv", queryset, *columns)
+>>> # ... the process dies, and is restarted ...
+>>> checkpoint = find_checkpoint("s3://bucket/users.csv")
+>>> write_csv_resumable(
+...     "s3://bucket/users.csv", queryset, *columns, download=checkpoint.download
+... )
+
+Whole-file checksums cannot be carried across processes, so resumable
+exports do not record `md5` / `sha256` - S3 still verifies the SHA-256
+checksum of each part.
+
+"""
+
+import base64
+import contextlib
+import hashlib
+import io
+import posixpath
+from typing import Any, Generator, List, Optional
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from . import db, settings as app_settings
+from .columns import Column, column_names
+from .csv import ChunkBuffer, KeysetQuerySetWriter
+from .models import CsvDownload, CsvExportCheckpoint
+from .types import OptionalSequence
+
+# S3 parts (other than the last) must be at least 5MB
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+class ResumableUpload:
+    """
+    Base class for uploads that can be resumed from a checkpoint.
+
+    Output is passed to `write`, and `commit` makes everything written so
+    far durable at the destination, updating the checkpoint (but not
+    saving it). `ready` says when it is worth committing.
+
+    """
+
+    def __init__(self, checkpoint: CsvExportCheckpoint) -> None:
+        self.checkpoint = checkpoint
+
+    @property
+    def ready(self) -> bool:
+        raise NotImplementedError
+
+    def write(self, data: bytes) -> None:
+        raise NotImplementedError
+
+    def commit(self) -> None:
+        raise NotImplementedError
+
+    def complete(self) -> None:
+        """Commit any remaining output and finish the upload."""
+        self.commit()
+
+
+class S3ResumableUpload(ResumableUpload):
+    """Multipart S3 upload, checkpointed after each part."""
+
+    def __init__(
+        self,
+        checkpoint: CsvExportCheckpoint,
+        bucket: str,
+        key: str,
+        part_size: int = DEFAULT_PART_SIZE,
+    ) -> None:
+        from . import s3
+
+        super().__init__(checkpoint)
+        self.client = s3.get_client()
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = io.BytesIO()
+        if not checkpoint.upload_id:
+            response = self.client.create_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                ContentType="text/csv",
+                ChecksumAlgorithm="SHA256",
+            )
+            checkpoint.upload_id = response["UploadId"]
+
+    @property
+    def ready(self) -> bool:
+        return self.buffer.tell() >= self.part_size
+
+    def write(self, data: bytes) -> None:
+        self.buffer.write(data)
+
+    def commit(self) -> None:
+        if self.buffer.tell():
+            self._upload_part()
+
+    def _upload_part(self) -> None:
+        data = self.buffer.getvalue()
+        number = len(self.checkpoint.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.checkpoint.upload_id,
+            PartNumber=number,
+            Body=data,
+            ChecksumSHA256=base64.b64encode(hashlib.sha256(data).digest()).decode(),
+        )
+        self.checkpoint.parts.append(
+            {
+                "PartNumber": number,
+                "ETag": response["ETag"],
+                "ChecksumSHA256": response["ChecksumSHA256"],
+            }
+        )
+        self.checkpoint.byte_count += len(data)
+        self.buffer = io.BytesIO()
+
+    def complete(self) -> None:
+        # the last part can be smaller than part_size (or even empty, if it is
+        # the only part)
+        if self.buffer.tell() or not self.checkpoint.parts:
+            self._upload_part()
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.checkpoint.upload_id,
+            MultipartUpload={"Parts": self.checkpoint.parts},
+        )
+
+
+class SFTPResumableUpload(ResumableUpload):
+    """SFTP upload, appended to from the last checkpointed offset."""
+
+    def __init__(self, checkpoint: CsvExportCheckpoint, client: Any, path: str) -> None:
+        super().__init__(checkpoint)
+        if offset := checkpoint.byte_count:
+            # anything after the checkpoint was not committed, so is discarded
+            self.file = client.open(path, "r+b")
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = client.open(path, "wb")
+
+    @property
+    def ready(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> None:
+        self.file.write(data)
+
+    def commit(self) -> None:
+        self.file.flush()
+        self.checkpoint.byte_count = self.file.tell()
+
+    def complete(self) -> None:
+        self.commit()
+        self.file.close()
+
+
+def redact_url(url: str) -> str:
+    """Return url without its password, as stored on the checkpoint."""
+    parts = urlparse(url)
+    if parts.password is None:
+        return url
+    netloc = parts.netloc.replace(f":{parts.password}@", "@", 1)
+    return parts._replace(netloc=netloc).geturl()
+
+
+def find_checkpoint(url: str) -> Optional[CsvExportCheckpoint]:
+    """Return the latest incomplete checkpoint for an export to url."""
+    return (
+        CsvExportCheckpoint.objects.filter(
+            destination=redact_url(url), completed_at__isnull=True
+        )
+        .select_related("download")
+        .order_by("-updated_at")
+        .first()
+    )
+
+
+@contextlib.contextmanager
+def open_upload(
+    url: str, checkpoint: CsvExportCheckpoint, part_size: int = DEFAULT_PART_SIZE
+) -> Generator[ResumableUpload, None, None]:
+    """Return the resumable upload for an "s3://..." or "sftp://..." url."""
+    scheme, _, path = url.partition("://")
+    if scheme == "s3":
+        from . import s3
+
+        bucket, key = s3.parse_url(path)
+        yield S3ResumableUpload(checkpoint, bucket, key, part_size=part_size)
+    elif scheme == "sftp":
+        from . import sftp
+
+        hostname, username, password, port, path = sftp.parse_url(url)
+        with sftp.sftp_client(hostname, username, port, password) as client:
+            yield SFTPResumableUpload(checkpoint, client, path)
+    else:
+        raise ValueError(f"Unsupported destination: '{url}'")
+
+
+def _get_checkpoint(
+    url: str,
+    download: Optional[CsvDownload],
+    user: Optional[settings.AUTH_USER_MODEL],
+    columns: List[str],
+) -> CsvExportCheckpoint:
+    if download:
+        return CsvExportCheckpoint.objects.get_or_create(
+            download=download, defaults={"destination": redact_url(url)}
+        )[0]
+    download = CsvDownload.objects.create(
+        user=user,
+        filename=posixpath.basename(urlparse(url).path),
+        columns=", ".join(columns),
+    )
+    return CsvExportCheckpoint.objects.create(
+        download=download, destination=redact_url(url)
+    )
+
+
+def _write_pages(
+    writer: KeysetQuerySetWriter,
+    sink: ChunkBuffer,
+    upload: ResumableUpload,
+    checkpoint: CsvExportCheckpoint,
+    statement_timeout: Optional[int],
+) -> None:
+    """Write pages to the upload, saving the checkpoint on each commit."""
+    batches = writer.write_batches()
+    while True:
+        # The timeout is applied to each page, rather than the whole export:
+        # on PostgreSQL it runs the block in a transaction, which would roll
+        # back the checkpoints if they were saved inside it.
+        with db.statement_timeout(writer.queryset.db, statement_timeout):
+            batch_count = next(batches, None)
+        if batch_count is None:
+            break
+        checkpoint.row_count += batch_count
+        upload.write(sink.drain())
+        if upload.ready:
+            upload.commit()
+            checkpoint.last_pk = writer.last_pk
+            checkpoint.save()
+    upload.write(sink.drain())
+    upload.complete()
+
+
+@transaction.atomic
+def _complete(checkpoint: CsvExportCheckpoint) -> None:
+    # the download's counts are saved with the checkpoint's completion, as
+    # the rollups only read the download once its checkpoint is complete
+    download = checkpoint.download
+    download.row_count = checkpoint.row_count
+    download.byte_count = checkpoint.byte_count
+    download.save(update_fields=["row_count", "byte_count"])
+    checkpoint.completed_at = timezone.now()
+    checkpoint.save()
+
+
+def write_csv_resumable(
+    url: str,
+    queryset: QuerySet,
+    *columns: Column,
+    download: Optional[CsvDownload] = None,
+    user: Optional[settings.AUTH_USER_MODEL] = None,
+    header: bool = True,
+    max_rows: Optional[int] = None,
+    column_headers: OptionalSequence = None,
+    part_size: int = DEFAULT_PART_SIZE,
+    using: Optional[str] = None,
+    statement_timeout: Optional[int] = None,
+    **writer_kwargs: Any,
+) -> CsvDownload:
+    """
+    Write a csv to S3 / SFTP, checkpointing progress so it can be resumed.
+
+    If download is None a new CsvDownload is created (for user), otherwise
+    the export carries on from the download's checkpoint - the url,
+    queryset and columns must be the same as before. Returns the
+    CsvDownload, with its row and byte counts, once the export is done.
+    Any other kwargs (e.g. page_size) are passed to KeysetQuerySetWriter.
+
+    """
+    checkpoint = _get_checkpoint(url, download, user, column_names(columns))
+    if checkpoint.is_complete:
+        return checkpoint.download
+    if max_rows is None:
+        max_rows = app_settings.MAX_ROWS
+    if statement_timeout is None:
+        statement_timeout = app_settings.STATEMENT_TIMEOUT
+    sink = ChunkBuffer()
+    with open_upload(url, checkpoint, part_size) as upload, io.TextIOWrapper(
+        sink, encoding="utf-8", newline="", write_through=True
+    ) as fileobj:
+        # save the upload id (if this is a new S3 upload) before anything else
+        checkpoint.save()
+        writer = KeysetQuerySetWriter(
+            fileobj,
+            queryset,
+            *columns,
+            max_rows=max_rows - checkpoint.row_count,
+            using=using,
+            start_after=checkpoint.last_pk,
+            **writer_kwargs,
+        )
+        # nothing has been committed until the first page has been written
+        if header and checkpoint.last_pk is None:
+            writer.write_header(column_headers=column_headers)
+        _write_pages(writer, sink, upload, checkpoint, statement_timeout)
+        writer.close()
+    _complete(checkpoint)
+    return checkpoint.download
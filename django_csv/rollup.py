@@ -0,0 +1,192 @@
+"""
+Daily rollups of CsvDownload, for usage analytics.
+
+`rollup_downloads` adds the CsvDownloads created since it last ran (those
+past the watermark, by pk) to CsvDownloadRollup - one row per day, user
+and filename - so it only ever reads new rows. It is run by the
+`rollup_csv_downloads` management command, e.g. from cron. Resumable
+exports (see `resume`) record their CsvDownload when they start, and its
+row / byte counts when they finish, so the watermark is held below any
+export that is still in progress.
+
+`usage_summary` answers usage queries (totals, daily trend, top users and
+largest exports) from the rollups, which are indexed on (date, user,
+filename), (user, date) and (filename, date) - the raw CsvDownload table
+is never aggregated.
+
+>>> rollup_downloads()
+1234
+>>> usage_summary(rollups_between(start, end)).top_users
+
+"""
+
+import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, Min, QuerySet, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import (
+    CsvDownload,
+    CsvDownloadRollup,
+    CsvDownloadRollupWatermark,
+    CsvExportCheckpoint,
+)
+
+# number of CsvDownloads added to the rollups per transaction
+DEFAULT_BATCH_SIZE = 10000
+# downloads newer than this (in seconds) are left for the next run, so that
+# rows committed out of pk order are not skipped by the watermark
+DEFAULT_SETTLE_TIME = 60
+# incomplete resumable exports whose checkpoint has not been saved for this
+# long (in seconds) are treated as abandoned, and no longer hold the watermark
+DEFAULT_PENDING_TIMEOUT = 24 * 60 * 60
+
+RollupKey = Tuple[datetime.date, Optional[int], str]
+
+
+def _merge(totals: List[Dict[str, Any]]) -> None:
+    """Add the totals for a batch of downloads to the rollups."""
+    existing: Dict[RollupKey, CsvDownloadRollup] = {
+        (r.date, r.user_id, r.filename): r
+        for r in CsvDownloadRollup.objects.filter(
+            date__in={t["date"] for t in totals},
+            filename__in={t["filename"] for t in totals},
+        )
+    }
+    created, updated = [], []
+    for total in totals:
+        key = (total["date"], total["user"], total["filename"])
+        if rollup := existing.get(key):
+            rollup.download_count += total["downloads"]
+            rollup.row_count += total["rows"]
+            rollup.byte_count += total["bytes"]
+            updated.append(rollup)
+        else:
+            created.append(
+                CsvDownloadRollup(
+                    date=total["date"],
+                    user_id=total["user"],
+                    filename=total["filename"],
+                    download_count=total["downloads"],
+                    row_count=total["rows"],
+                    byte_count=total["bytes"],
+                )
+            )
+    CsvDownloadRollup.objects.bulk_update(
+        updated, ["download_count", "row_count", "byte_count"]
+    )
+    CsvDownloadRollup.objects.bulk_create(created)
+
+
+def _pending_download_id(active_since: datetime.datetime) -> Optional[int]:
+    """Return the pk of the oldest download with an export in progress."""
+    return CsvExportCheckpoint.objects.filter(
+        completed_at__isnull=True, updated_at__gte=active_since
+    ).aggregate(pk=Min("download_id"))["pk"]
+
+
+@transaction.atomic
+def _rollup_batch(
+    batch_size: int, before: datetime.datetime, active_since: datetime.datetime
+) -> int:
+    """Add the next batch of downloads to the rollups, and move the watermark."""
+    watermark = CsvDownloadRollupWatermark.objects.select_for_update().get_or_create(
+        pk=1
+    )[0]
+    downloads = CsvDownload.objects.filter(pk__gt=watermark.last_download_id)
+    ready = downloads.filter(timestamp__lt=before)
+    if (pending := _pending_download_id(active_since)) is not None:
+        ready = ready.filter(pk__lt=pending)
+    pks = list(ready.order_by("pk").values_list("pk", flat=True)[:batch_size])
+    if not pks:
+        return 0
+    totals = list(
+        downloads.filter(pk__lte=pks[-1])
+        .annotate(date=TruncDate("timestamp"))
+        .order_by()
+        .values("date", "user", "filename")
+        .annotate(
+            downloads=Count("pk"),
+            rows=Coalesce(Sum("row_count"), 0),
+            bytes=Coalesce(Sum("byte_count"), 0),
+        )
+    )
+    _merge(totals)
+    watermark.last_download_id = pks[-1]
+    watermark.save()
+    return sum(total["downloads"] for total in totals)
+
+
+def rollup_downloads(
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    settle_time: int = DEFAULT_SETTLE_TIME,
+    pending_timeout: int = DEFAULT_PENDING_TIMEOUT,
+) -> int:
+    """
+    Add new CsvDownloads to the rollups, returning the number added.
+
+    Downloads are processed in pk order, batch_size at a time, each batch
+    in its own transaction (with the watermark locked), so the rollups and
+    watermark always agree and concurrent runs do not double count. The
+    watermark stops short of the oldest incomplete resumable export, unless
+    its checkpoint is older than pending_timeout secs.
+
+    """
+    now = timezone.now()
+    before = now - datetime.timedelta(seconds=settle_time)
+    active_since = now - datetime.timedelta(seconds=pending_timeout)
+    total = 0
+    while count := _rollup_batch(batch_size, before, active_since):
+        total += count
+    return total
+
+
+def rollups_between(start: datetime.date, end: datetime.date) -> QuerySet:
+    """Return the rollups from start to end (inclusive)."""
+    return CsvDownloadRollup.objects.filter(date__gte=start, date__lte=end)
+
+
+def _totals(rollups: QuerySet, *fields: str) -> QuerySet:
+    return (
+        rollups.order_by()
+        .values(*fields)
+        .annotate(
+            downloads=Sum("download_count"),
+            rows=Sum("row_count"),
+            bytes=Sum("byte_count"),
+        )
+    )
+
+
+class UsageSummary(NamedTuple):
+    # {"downloads", "rows", "bytes"} across all the rollups
+    totals: Dict[str, int]
+    # totals per day, in date order
+    daily: List[Dict[str, Any]]
+    # totals per user / filename, largest (by bytes, then rows) first
+    top_users: List[Dict[str, Any]]
+    top_filenames: List[Dict[str, Any]]
+
+
+def usage_summary(rollups: QuerySet, limit: int = 10) -> UsageSummary:
+    """Summarise a queryset of CsvDownloadRollup (e.g. from rollups_between)."""
+    username = f"user__{get_user_model().USERNAME_FIELD}"
+    totals = rollups.aggregate(
+        downloads=Coalesce(Sum("download_count"), 0),
+        rows=Coalesce(Sum("row_count"), 0),
+        bytes=Coalesce(Sum("byte_count"), 0),
+    )
+    largest = ("-bytes", "-rows")
+    return UsageSummary(
+        totals=totals,
+        daily=list(_totals(rollups, "date").order_by("date")),
+        top_users=[
+            {"user": row.pop("user"), "username": row.pop(username), **row}
+            for row in _totals(rollups, "user", username).order_by(*largest)[:limit]
+        ],
+        top_filenames=list(_totals(rollups, "filename").order_by(*largest)[:limit]),
+    )
@@ -1,38 +1,92 @@
-"""Optional functions for uploading data direct to S3."""
+"""
+Optional functions for uploading data direct to S3.
+
+boto3 is slow to import, so it is only imported when the first client is
+created, rather than when this module is imported.
+
+"""
 
 import contextlib
+import threading
 from io import BytesIO, TextIOWrapper
 from tempfile import TemporaryFile
-from typing import IO, Generator, Tuple, Union
+from typing import IO, Any, Dict, Generator, Optional, Tuple, Union
 
+from django.conf import settings
 from django.db.models import QuerySet
 
+from .checksum import Checksum, ChecksumWriter, get_checksum
+from .columns import Column, column_names
 from .csv import write_csv
-from .settings import MAX_ROWS
-
-try:
-    import boto3
-except ImportError:
-    raise ImportError("You cannot use the django_csv.s3 module without boto3.")
+from .models import CsvDownload
 
 # type used to smooth over TemporaryFile <> BytesIO mismatch
 FileLikeObject = Union[IO[bytes], BytesIO]
 # type to represent an S3 address (bucket, key)
 S3Url = Tuple[str, str]
 
+# S3 clients are cached per thread, so that connections are reused
+_local = threading.local()
+
+
+def _import_boto3() -> Any:
+    try:
+        import boto3
+    except ImportError:
+        raise ImportError("You cannot use the django_csv.s3 module without boto3.")
+    return boto3
+
+
+def get_client() -> Any:
+    """
+    Return an S3 client for the current thread.
+
+    The client (and its connection pool) is reused for all uploads made
+    from the same thread. A new session is used per thread, as boto3
+    sessions are not thread-safe.
+
+    """
+    if not hasattr(_local, "client"):
+        _local.client = _import_boto3().session.Session().client("s3")
+    return _local.client
+
 
 # extracted out to facilitate testing
-def _put_object(bucket: str, key: str, fileobj: FileLikeObject) -> None:
+def _put_object(
+    bucket: str,
+    key: str,
+    fileobj: FileLikeObject,
+    checksum: Optional[Checksum] = None,
+) -> None:
     """Upload binary stream to S3 using put_pubject."""
-    client = boto3.client("s3")
-    client.put_object(Bucket=bucket, Key=key, Body=fileobj, ContentType="text/csv")
+    client = get_client()
+    kwargs = {}
+    if checksum:
+        kwargs = {
+            "ContentMD5": checksum.content_md5,
+            "ChecksumSHA256": checksum.checksum_sha256,
+        }
+    client.put_object(
+        Bucket=bucket, Key=key, Body=fileobj, ContentType="text/csv", **kwargs
+    )
 
 
 # extracted out to facilitate testing
-def _upload_fileobj(bucket: str, key: str, fileobj: FileLikeObject) -> None:
+def _upload_fileobj(
+    bucket: str,
+    key: str,
+    fileobj: FileLikeObject,
+    checksum: Optional[Checksum] = None,
+) -> None:
     """Upload binary stream to S3 using upload_fileobj."""
-    client = boto3.client("s3")
-    client.upload_fileobj(fileobj, bucket, key)
+    client = get_client()
+    extra_args: Dict[str, Any] = {"ContentType": "text/csv"}
+    if checksum:
+        # S3 validates a SHA-256 checksum of each part as it is uploaded, and
+        # the whole-file digests are stored as metadata.
+        extra_args["ChecksumAlgorithm"] = "SHA256"
+        extra_args["Metadata"] = {"md5": checksum.md5, "sha256": checksum.sha256}
+    client.upload_fileobj(fileobj, bucket, key, ExtraArgs=extra_args)
 
 
 @contextlib.contextmanager
@@ -47,14 +101,18 @@ def s3_upload_multipart(bucket: str, key: str) -> Generator:
     >>> with s3_upload_fileobj("bucket", "obj_key") as fileobj:
     ...     write_csv(fileobj, queryset, "col1", "col2")
 
+    The checksum of the file is calculated as it is written, and is
+    available afterwards as `get_checksum(fileobj)`.
+
     """
     with TemporaryFile() as fileobj:
+        writer = ChecksumWriter(fileobj)
         with TextIOWrapper(
-            fileobj, encoding="utf-8", newline="", write_through=True
+            writer, encoding="utf-8", newline="", write_through=True
         ) as buffer:
             yield buffer
             fileobj.seek(0)
-            _upload_fileobj(bucket, key, fileobj)
+            _upload_fileobj(bucket, key, fileobj, checksum=writer.checksum)
 
 
 @contextlib.contextmanager
@@ -69,14 +127,18 @@ def s3_upload(bucket: str, key: str) -> Generator:
     >>> with s3_put_object("bucket", "obj_key") as fileobj:
     ...     write_csv(fileobj, queryset, "col1", "col2")
 
+    The checksum of the file is calculated as it is written, and is
+    available afterwards as `get_checksum(fileobj)`.
+
     """
     with BytesIO() as fileobj:
+        writer = ChecksumWriter(fileobj)
         with TextIOWrapper(
-            fileobj, encoding="utf-8", newline="", write_through=True
+            writer, encoding="utf-8", newline="", write_through=True
         ) as buffer:
             yield buffer
             fileobj.seek(0)
-            _put_object(bucket, key, fileobj)
+            _put_object(bucket, key, fileobj, checksum=writer.checksum)
 
 
 def parse_url(url: str) -> S3Url:
@@ -92,11 +154,38 @@ def parse_url(url: str) -> S3Url:
 def write_csv_s3(
     url: str,
     queryset: QuerySet,
-    *columns: str,
+    *columns: Column,
     header: bool = True,
-    max_rows: int = MAX_ROWS,
+    max_rows: Optional[int] = None,
+    multipart: bool = False,
+    record: bool = False,
+    user: Optional[settings.AUTH_USER_MODEL] = None,
+    **kwargs: Any,
 ) -> int:
-    """Write a csv to S3."""
+    """
+    Write a csv to S3.
+
+    If multipart is True the file is written to a temporary file and uploaded
+    with `upload_fileobj`, otherwise it is buffered in memory and uploaded
+    with `put_object`. Any other kwargs are passed through to `write_csv`.
+
+    If record is True the upload is recorded as a CsvDownload (for user),
+    along with its size and checksums.
+
+    """
     bucket, key = parse_url(url)
-    with s3_upload(bucket, key) as fileobj:
-        return write_csv(fileobj, queryset, *columns, header=header, max_rows=max_rows)
+    upload = s3_upload_multipart if multipart else s3_upload
+    with upload(bucket, key) as fileobj:
+        row_count = write_csv(
+            fileobj, queryset, *columns, header=header, max_rows=max_rows, **kwargs
+        )
+        checksum = get_checksum(fileobj)
+    if record:
+        CsvDownload.objects.create(
+            user=user,
+            filename=key.rsplit("/", 1)[-1],
+            row_count=row_count,
+            columns=", ".join(column_names(columns)),
+            **checksum.as_fields(),
+        )
+    return row_count
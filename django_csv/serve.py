@@ -0,0 +1,174 @@
+"""
+Functions for serving exports that have already been written to storage.
+
+Stored exports are served as files - with `ETag`, `Last-Modified` and
+`Content-Length` headers, and support for (single) `Range` / `If-Range`
+requests - so that an interrupted download can be resumed without the
+export being recomputed. Full downloads use `FileResponse`, which hands
+the file to the server's `wsgi.file_wrapper` (e.g. sendfile) if it can.
+
+"""
+
+import re
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from django.conf import settings
+from django.core.files.storage import Storage, default_storage
+from django.http import FileResponse, HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.module_loading import import_string
+
+from . import settings as app_settings
+from .models import CsvDownload
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# block size used when streaming partial content
+BLOCK_SIZE = 64 * 1024
+
+# (start, end) of a byte range - both inclusive
+ByteRange = Tuple[int, int]
+
+
+class RangeFile:
+    """File-like wrapper that reads a byte range from a file."""
+
+    def __init__(self, fileobj: Any, start: int, length: int) -> None:
+        self.fileobj = fileobj
+        self.fileobj.seek(start)
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.fileobj.close()
+
+
+def get_storage() -> Storage:
+    """Return the storage that stored exports are served from."""
+    if path := app_settings.STORAGE:
+        return import_string(path)()
+    return default_storage
+
+
+def parse_range(header: str, size: int) -> Optional[ByteRange]:
+    """
+    Parse a Range header, returning the (start, end) of the range.
+
+    Returns None if the header cannot be parsed (or is a multi-range
+    request, which is not supported), in which case the header should
+    be ignored, and raises ValueError if the range is unsatisfiable.
+
+    """
+    if not (match := RANGE_RE.match(header.strip())):
+        return None
+    first, last = match.groups()
+    if not first:
+        # suffix range - the last N bytes
+        if not last:
+            return None
+        if not (suffix := int(last)):
+            raise ValueError("Unsatisfiable range")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def get_etag(download: CsvDownload, size: int, modified: datetime) -> str:
+    """Return the (strong) ETag for the stored file."""
+    return f'"{download.pk:x}-{size:x}-{int(modified.timestamp()):x}"'
+
+
+def if_range_matches(request: HttpRequest, etag: str, modified: datetime) -> bool:
+    """Return True if there is no If-Range header, or if it still matches."""
+    if not (if_range := request.headers.get("If-Range")):
+        return True
+    if if_range.startswith(('"', "W/")):
+        # weak ETags cannot be used for range requests
+        return if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and int(modified.timestamp()) <= if_range_date
+
+
+def _get_modified_time(storage: Storage, download: CsvDownload) -> datetime:
+    try:
+        return storage.get_modified_time(download.storage_name)
+    except NotImplementedError:
+        return download.timestamp
+
+
+def serve_stored_csv(
+    request: HttpRequest,
+    download: CsvDownload,
+    storage: Optional[Storage] = None,
+    user: Optional[settings.AUTH_USER_MODEL] = None,
+) -> HttpResponse:
+    """
+    Serve a stored export, supporting conditional and range requests.
+
+    Each download that starts from the beginning of the file is recorded
+    as a new CsvDownload (for user), linked to the original via `source`,
+    but the export itself is not recomputed. Requests that resume part way
+    through the file are not recorded.
+
+    """
+    storage = storage or get_storage()
+    size = storage.size(download.storage_name)
+    modified = _get_modified_time(storage, download)
+    etag = get_etag(download, size, modified)
+    if response := get_conditional_response(
+        request, etag=etag, last_modified=int(modified.timestamp())
+    ):
+        return response
+
+    byte_range: Optional[ByteRange] = None
+    if (header := request.headers.get("Range")) and if_range_matches(
+        request, etag, modified
+    ):
+        try:
+            byte_range = parse_range(header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    fileobj = storage.open(download.storage_name, "rb")
+    if byte_range:
+        start, end = byte_range
+        response = FileResponse(
+            RangeFile(fileobj, start, end - start + 1),
+            status=206,
+            as_attachment=True,
+            filename=download.filename,
+            content_type="text/csv",
+        )
+        response.block_size = BLOCK_SIZE
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = end - start + 1
+    else:
+        start = 0
+        response = FileResponse(
+            fileobj,
+            as_attachment=True,
+            filename=download.filename,
+            content_type="text/csv",
+        )
+        response["Content-Length"] = size
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(modified.timestamp())
+    if start == 0 and request.method == "GET":
+        download.record_redownload(user, byte_count=size)
+    return response
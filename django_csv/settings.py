@@ -1,7 +1,86 @@
+"""
+App settings, resolved from the Django settings at call time.
+
+Each setting is read (and cached) the first time it is accessed as an
+attribute of this module, e.g. `settings.MAX_ROWS`, rather than when the
+module is imported, and the cache is cleared whenever a CSV_DOWNLOAD_*
+setting changes (e.g. with `override_settings`). Import the module and
+read the attribute when it is needed - `from .settings import MAX_ROWS`
+would freeze the value at import time.
+
+"""
+
+from typing import Any, Dict, Tuple
+
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+SETTINGS_PREFIX = "CSV_DOWNLOAD_"
+
+# {name: (Django setting, default)}
+DEFAULTS: Dict[str, Tuple[str, Any]] = {
+    # Cap on the number of rows that can be downloaded
+    "MAX_ROWS": ("CSV_DOWNLOAD_MAX_ROWS", 10000),
+    # Default page size used by PagedQuerySetWriter
+    "DEFAULT_PAGE_SIZE": ("CSV_DOWNLOAD_PAGE_SIZE", 10000),
+    # Number of rows fetched (and written) per batch by BulkQuerySetWriter
+    "DEFAULT_BATCH_SIZE": ("CSV_DOWNLOAD_BATCH_SIZE", 2000),
+    # Minimum size (in bytes) of each chunk yielded when streaming output
+    "DEFAULT_CHUNK_SIZE": ("CSV_DOWNLOAD_CHUNK_SIZE", 64 * 1024),
+    # Database alias to run export queries against - if None the database router
+    # decides, which will route to a read replica if one is configured.
+    "EXPORT_DB_ALIAS": ("CSV_DOWNLOAD_DB_ALIAS", None),
+    # Statement timeout (in milliseconds) applied to export queries, on backends
+    # that support it (PostgreSQL, MySQL, MariaDB). None means no timeout.
+    "STATEMENT_TIMEOUT": ("CSV_DOWNLOAD_STATEMENT_TIMEOUT", None),
+    # Max number of concurrent exports, globally and per user. None is unlimited.
+    "MAX_CONCURRENT": ("CSV_DOWNLOAD_MAX_CONCURRENT", None),
+    "MAX_CONCURRENT_PER_USER": ("CSV_DOWNLOAD_MAX_CONCURRENT_PER_USER", None),
+    # Dotted path to the backend used to enforce the concurrency limits
+    "CONCURRENCY_BACKEND": (
+        "CSV_DOWNLOAD_CONCURRENCY_BACKEND",
+        "django_csv.throttle.LocalConcurrencyBackend",
+    ),
+    # Seconds to wait for a free export slot before giving up (0 = don't wait)
+    "QUEUE_TIMEOUT": ("CSV_DOWNLOAD_QUEUE_TIMEOUT", 0),
+    # Seconds to send in the Retry-After header when an export is throttled
+    "RETRY_AFTER": ("CSV_DOWNLOAD_RETRY_AFTER", 30),
+    # Max number of rows a user can download per period (in seconds). None is
+    # unlimited.
+    "ROW_QUOTA": ("CSV_DOWNLOAD_ROW_QUOTA", None),
+    "ROW_QUOTA_PERIOD": ("CSV_DOWNLOAD_ROW_QUOTA_PERIOD", 24 * 60 * 60),
+    # Number of rows sampled to estimate the size of an export
+    "ESTIMATE_SAMPLE_SIZE": ("CSV_DOWNLOAD_ESTIMATE_SAMPLE_SIZE", 100),
+    # Dotted path to the Storage class that stored exports are served from. None
+    # means default_storage.
+    "STORAGE": ("CSV_DOWNLOAD_STORAGE", None),
+    # Dotted path to the row encoder used by the writers (see encoders.py)
+    "ENCODER": ("CSV_DOWNLOAD_ENCODER", "django_csv.encoders.CsvRowEncoder"),
+    # Profile the encoder of every export with cProfile, and the directory the
+    # stats are written to. If the directory is None the stats are logged.
+    "PROFILE": ("CSV_DOWNLOAD_PROFILE", False),
+    "PROFILE_DIR": ("CSV_DOWNLOAD_PROFILE_DIR", None),
+}
+
+_cache: Dict[str, Any] = {}
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        return _cache[name]
+    except KeyError:
+        pass
+    try:
+        setting, default = DEFAULTS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    _cache[name] = value = getattr(settings, setting, default)
+    return value
 
-# Cap on the number of rows that can be downloaded
-MAX_ROWS = getattr(settings, "CSV_DOWNLOAD_MAX_ROWS", 10000)
 
-# Default page size used by PagedQuerySetWriter
-DEFAULT_PAGE_SIZE = getattr(settings, "CSV_DOWNLOAD_PAGE_SIZE", 10000)
+@receiver(setting_changed)
+def clear_cache(*, setting: str, **kwargs: Any) -> None:
+    """Clear the cached settings when a CSV_DOWNLOAD_* setting changes."""
+    if setting.startswith(SETTINGS_PREFIX):
+        _cache.clear()
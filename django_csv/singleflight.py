@@ -0,0 +1,249 @@
+"""
+Single-flight coalescing of concurrent identical exports.
+
+When several users request the same export at the same time (e.g. from a
+shared dashboard link) only the first request - the leader - runs it,
+writing it to storage (see `storage.write_csv_storage`). Concurrent
+requests for the same export wait for the leader to finish, and are then
+served the same stored file. Every requester still gets a CsvDownload -
+the leader's records the export, and each of the others is linked to it
+via `source`.
+
+Exports are identified by `export_key` - a hash of the compiled query
+(SQL, params and database) and the spec (columns, headers, row limit,
+writer). Requests are coordinated within a process with a lock, and
+across processes with a lock in the Django cache (`cache.add`), so only
+one process runs each export - use a shared cache (e.g. Redis or
+Memcached) for multi-process deployments.
+
+>>> download_csv_coalesced(request.user, "users.csv", queryset, *columns)
+
+Coalesced exports are left in storage, so they can be re-downloaded
+(e.g. with StoredCsvDownloadView) - clean them up as you would any other
+stored export.
+
+"""
+
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.core.files.storage import Storage
+from django.db.models import QuerySet
+from django.http import FileResponse, HttpResponse
+
+from . import settings as app_settings
+from .columns import Column, ColumnPlan
+from .csv import BaseQuerySetWriter, BulkQuerySetWriter
+from .models import CsvDownload
+from .serve import get_storage
+from .storage import write_csv_storage
+from .types import OptionalSequence
+
+logger = logging.getLogger(__name__)
+
+# storage directory that coalesced exports are written to
+STORAGE_DIR = "csv-exports"
+
+# returned by cache.get when a key is missing (None can be a valid result)
+MISSING: Any = object()
+
+# CsvDownload fields shared with followers - they are not read back from the
+# database, as the leader's row may not be visible to them yet (e.g. with
+# ATOMIC_REQUESTS, or reads routed to a lagging replica)
+SHARED_FIELDS = (
+    "pk",
+    "filename",
+    "row_count",
+    "byte_count",
+    "md5",
+    "sha256",
+    "columns",
+    "storage_name",
+)
+
+
+def export_key(queryset: QuerySet, *columns: Column, **spec: Any) -> str:
+    """
+    Return the key that identifies an export - its compiled query and spec.
+
+    The spec is any other arguments that affect the output (e.g. the
+    headers and max_rows). BatchColumns are identified by their name, key
+    and default, as their fetch functions can't be compared.
+
+    """
+    plan = ColumnPlan(columns)
+    rows = plan.values_list(queryset)
+    try:
+        # compiled for the queryset's database, not the default alias
+        sql, params = rows.query.get_compiler(using=rows.db).as_sql()
+    except EmptyResultSet:
+        # e.g. queryset.none() - there is no query to run
+        sql, params = "", ()
+    batch_columns = [(c.name, c.key, c.default) for c in plan.batch_columns]
+    data = (rows.db, sql, params, plan.names, batch_columns, sorted(spec.items()))
+    return hashlib.sha256(repr(data).encode()).hexdigest()
+
+
+class Flight:
+    """A call in progress in this process, that other threads can wait for."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Run a function once per key, for all the callers that arrive together.
+
+    Within a process, callers with the same key share a Flight (so only
+    one thread per process touches the cache). Across processes, the
+    caller that adds the key's lock to the cache runs the function, and
+    the others poll the cache for its result. The result must be
+    cacheable (e.g. a dict of values).
+
+    If the leader does not finish within `wait_timeout` secs, or goes away
+    without a result (e.g. it crashed), the waiting caller runs the
+    function itself. Locks expire after `lock_ttl` secs, so that a lock
+    leaked by a crashed process is eventually recovered.
+
+    """
+
+    cache_alias = "default"
+    key_prefix = "django_csv:singleflight:"
+    lock_ttl = 10 * 60
+    result_ttl = 60
+    wait_timeout = 10 * 60
+    poll_interval = 0.1
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.flights: Dict[str, Flight] = {}
+
+    @property
+    def cache(self) -> Any:
+        return caches[self.cache_alias]
+
+    def run(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (result, True if this call ran func) for key."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if leader := flight is None:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            return flight.wait(), False
+        try:
+            flight.result, ran = self._run_shared(key, func)
+            return flight.result, ran
+        except BaseException as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def _run_shared(self, key: str, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        lock_key = self.key_prefix + key
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            token = uuid.uuid4().hex
+            if self.cache.add(lock_key, token, self.lock_ttl):
+                return self._lead(lock_key, token, func), True
+            if (result := self._follow(lock_key, deadline)) is not MISSING:
+                return result, False
+        logger.warning("Timed out waiting for export '%s' - running it", key)
+        return func(), True
+
+    def _lead(self, lock_key: str, token: str, func: Callable[[], Any]) -> Any:
+        try:
+            result = func()
+            # followers look the result up by the token they saw in the lock
+            self.cache.set(f"{lock_key}:{token}", result, self.result_ttl)
+            return result
+        finally:
+            if self.cache.get(lock_key) == token:
+                self.cache.delete(lock_key)
+
+    def _follow(self, lock_key: str, deadline: float) -> Any:
+        """Wait for the current leader's result, or MISSING if it went away."""
+        if (token := self.cache.get(lock_key)) is None:
+            return MISSING
+        result_key = f"{lock_key}:{token}"
+        while self.cache.get(lock_key) == token and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+        # the result is set before the lock is deleted
+        return self.cache.get(result_key, MISSING)
+
+
+single_flight = SingleFlight()
+
+
+def download_csv_coalesced(
+    user: settings.AUTH_USER_MODEL,
+    filename: str,
+    queryset: QuerySet,
+    *columns: Column,
+    header: bool = True,
+    max_rows: Optional[int] = None,
+    column_headers: OptionalSequence = None,
+    writer_klass: Type[BaseQuerySetWriter] = BulkQuerySetWriter,
+    using: Optional[str] = None,
+    statement_timeout: Optional[int] = None,
+    storage: Optional[Storage] = None,
+    **writer_kwargs: Any,
+) -> HttpResponse:
+    """
+    Download queryset as a CSV, sharing the export with identical requests.
+
+    Takes the same arguments as `download_csv`. The export is written to
+    storage (default CSV_DOWNLOAD_STORAGE) by the first of any concurrent
+    identical requests, and served from there to all of them.
+
+    """
+    storage = storage or get_storage()
+    kwargs: Dict[str, Any] = dict(
+        header=header,
+        max_rows=app_settings.MAX_ROWS if max_rows is None else max_rows,
+        column_headers=column_headers,
+        writer_klass=writer_klass,
+        using=using,
+        statement_timeout=statement_timeout,
+        **writer_kwargs,
+    )
+    key = export_key(queryset, *columns, filename=filename, **kwargs)
+
+    def _export() -> Dict[str, Any]:
+        name = f"{STORAGE_DIR}/{uuid.uuid4().hex}/{filename}"
+        download = write_csv_storage(
+            storage, name, queryset, *columns, user=user, **kwargs
+        )
+        return {field: getattr(download, field) for field in SHARED_FIELDS}
+
+    result, ran = single_flight.run(key, _export)
+    download = CsvDownload(**result)
+    if not ran:
+        download.record_redownload(user)
+    response = FileResponse(
+        storage.open(download.storage_name, "rb"),
+        as_attachment=True,
+        filename=filename,
+        content_type="text/csv",
+    )
+    response["Content-Length"] = download.byte_count
+    response["X-Row-Count"] = download.row_count
+    return response
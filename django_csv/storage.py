@@ -0,0 +1,123 @@
+"""
+Functions for writing CSVs to a Django Storage backend.
+
+The CSV is streamed into the storage backend in encoded chunks, as it
+is generated, rather than being written out to a file first, so this
+works with any storage that reads its content via `File.chunks()`
+(which includes `FileSystemStorage`, and most third-party backends).
+
+>>> write_csv_storage(default_storage, "exports/users.csv", queryset, *columns)
+<CsvDownload: users.csv>
+
+"""
+
+import io
+import os
+import uuid
+from typing import Any, Generator, Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
+from django.db.models import QuerySet
+
+from . import settings as app_settings
+from .checksum import Checksum
+from .columns import Column, column_names
+from .csv import stream_csv
+from .models import CsvDownload
+
+
+class GeneratorStream(io.RawIOBase):
+    """
+    Read-only binary stream over a generator of bytes.
+
+    The generator's return value (e.g. the row count returned by
+    `stream_csv`) is stored as `result` once the stream is exhausted, and
+    the checksum (and size) of the bytes read so far as `checksum`.
+
+    """
+
+    def __init__(self, generator: Generator[bytes, None, Any]) -> None:
+        super().__init__()
+        self.generator = generator
+        self.leftover = b""
+        self.result: Any = None
+        self.checksum = Checksum()
+        self.exhausted = False
+
+    @property
+    def size(self) -> int:
+        return self.checksum.size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while not self.leftover:
+            if self.exhausted:
+                return 0
+            try:
+                self.leftover = next(self.generator)
+            except StopIteration as ex:
+                self.result = ex.value
+                self.exhausted = True
+        count = min(len(buffer), len(self.leftover))
+        buffer[:count] = data = self.leftover[:count]
+        self.leftover = self.leftover[count:]
+        self.checksum.update(data)
+        return count
+
+
+def _save_atomic(storage: FileSystemStorage, name: str, content: File) -> str:
+    """Save to a temporary name and then move into place, replacing name."""
+    temp_name = f"{name}.{uuid.uuid4().hex}.tmp"
+    try:
+        temp_name = storage.save(temp_name, content)
+        os.replace(storage.path(temp_name), storage.path(name))
+    finally:
+        if storage.exists(temp_name):
+            storage.delete(temp_name)
+    return name
+
+
+def write_csv_storage(
+    storage: Storage,
+    name: str,
+    queryset: QuerySet,
+    *columns: Column,
+    user: Optional[settings.AUTH_USER_MODEL] = None,
+    chunk_size: Optional[int] = None,
+    **kwargs: Any,
+) -> CsvDownload:
+    """
+    Write a csv to a storage backend, and record it as a CsvDownload.
+
+    The download is recorded with the size and checksums of the file,
+    which are calculated as it is streamed.
+
+    On FileSystemStorage the file is written to a temporary name and then
+    renamed, so that the file at `name` is replaced atomically (and never
+    seen half-written). Other storages use `Storage.save`, which may pick
+    a different name if `name` already exists - use the `storage_name` on
+    the returned CsvDownload. Any other kwargs are passed through to
+    `stream_csv`.
+
+    """
+    chunk_size = chunk_size or app_settings.DEFAULT_CHUNK_SIZE
+    stream = GeneratorStream(
+        stream_csv(queryset, *columns, chunk_size=chunk_size, **kwargs)
+    )
+    content = File(io.BufferedReader(stream, buffer_size=chunk_size), name=name)
+    if isinstance(storage, FileSystemStorage):
+        name = _save_atomic(storage, name, content)
+    else:
+        name = storage.save(name, content)
+    return CsvDownload.objects.create(
+        user=user,
+        filename=os.path.basename(name),
+        row_count=stream.result,
+        columns=", ".join(column_names(columns)),
+        storage_name=name,
+        **stream.checksum.as_fields(),
+    )
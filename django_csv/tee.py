@@ -0,0 +1,141 @@
+"""
+Functions for writing a single QuerySet pass to multiple destinations.
+
+The CSV is encoded once, in blocks, and each block is handed to every
+destination via its own bounded queue, drained by its own thread. This
+means the query is only run once, and a slow destination only holds up
+the others once its queue is full.
+
+Destinations are binary file-like objects - anything with a `write(bytes)`
+method. The upload context managers in `s3` and `sftp` yield text buffers,
+so pass their underlying binary `buffer` in:
+
+>>> with s3_upload("bucket", "key") as s3file:
+...     with sftp_upload(client, "path/to/file.csv") as sftpfile:
+...         write_csv_tee([s3file.buffer, sftpfile.buffer], queryset, *columns)
+
+"""
+
+import io
+import logging
+import queue
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+from django.db.models import QuerySet
+
+from .columns import Column
+from .csv import write_csv
+
+logger = logging.getLogger(__name__)
+
+# Size (in bytes) of each encoded block written to the destinations
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+# Number of blocks that can be queued for each destination
+DEFAULT_QUEUE_SIZE = 16
+
+
+class TeeError(Exception):
+    """
+    Raised when one or more destinations failed.
+
+    The `errors` attribute maps the index of each failed destination to
+    the exception it raised, and `row_count` is the number of rows that
+    were written to the destinations that did not fail.
+
+    """
+
+    def __init__(self, errors: Dict[int, Exception], row_count: int) -> None:
+        super().__init__(f"CSV write failed for destination(s) {sorted(errors)}.")
+        self.errors = errors
+        self.row_count = row_count
+
+
+class Destination(threading.Thread):
+    """Thread that writes queued blocks out to a single fileobj."""
+
+    def __init__(self, fileobj: Any, queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        super().__init__(daemon=True)
+        self.fileobj = fileobj
+        self.queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.error: Optional[Exception] = None
+
+    def run(self) -> None:
+        while (block := self.queue.get()) is not None:
+            if self.error:
+                # keep draining the queue so that the producer is not blocked
+                continue
+            try:
+                self.fileobj.write(block)
+            except Exception as ex:
+                logger.exception("Error writing CSV block to %r", self.fileobj)
+                self.error = ex
+
+
+class FanOut(io.RawIOBase):
+    """Binary stream that copies each block written to all destinations."""
+
+    def __init__(self, destinations: List[Destination], fail_fast: bool) -> None:
+        super().__init__()
+        self.destinations = destinations
+        self.fail_fast = fail_fast
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        block = bytes(data)
+        for destination in self.destinations:
+            if destination.error:
+                if self.fail_fast:
+                    raise destination.error
+                continue
+            destination.queue.put(block)
+        return len(block)
+
+
+def write_csv_tee(
+    fileobjs: Iterable[Any],
+    queryset: QuerySet,
+    *columns: Column,
+    fail_fast: bool = True,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    **kwargs: Any,
+) -> int:
+    """
+    Write QuerySet to multiple binary fileobjs in CSV format, in one pass.
+
+    Takes the same kwargs as `write_csv`, and returns the row count.
+
+    If `fail_fast` is True then the first destination error aborts the
+    whole write. If False, the remaining destinations are written to
+    completion. Either way a TeeError is raised at the end if any
+    destination failed.
+
+    """
+    destinations = [Destination(fileobj, queue_size) for fileobj in fileobjs]
+    for destination in destinations:
+        destination.start()
+    fanout = FanOut(destinations, fail_fast=fail_fast)
+    row_count = 0
+    try:
+        with io.TextIOWrapper(
+            io.BufferedWriter(fanout, buffer_size=block_size),
+            encoding="utf-8",
+            newline="",
+        ) as fileobj:
+            row_count = write_csv(fileobj, queryset, *columns, **kwargs)
+    except Exception as ex:
+        # destination errors raised by fail_fast are reported below
+        if not any(ex is d.error for d in destinations):
+            raise
+    finally:
+        for destination in destinations:
+            destination.queue.put(None)
+        for destination in destinations:
+            destination.join()
+    if errors := {i: d.error for i, d in enumerate(destinations) if d.error}:
+        raise TeeError(errors, row_count)
+    return row_count
@@ -0,0 +1,231 @@
+"""
+Admission control for exports.
+
+Exports are expensive, so this module provides two forms of protection:
+
+1. Concurrency limits - a cap on the number of exports that can run at
+once, globally and per user. These are enforced through a pluggable
+backend - `LocalConcurrencyBackend` counts slots in-process, whereas
+`CacheConcurrencyBackend` counts them in the Django cache, and so works
+across processes / servers.
+
+2. Row quotas - a cap on the number of rows a user can download in a
+given period, checked against their `CsvDownload` history.
+
+>>> check_row_quota(request.user)
+>>> with export_slot(request.user):
+...     return download_csv(request.user, "users.csv", queryset, *columns)
+
+Both raise `ExportThrottled` if the export cannot go ahead.
+
+"""
+
+import contextlib
+import functools
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+from typing import Any, Generator, List, Optional
+
+from django.core.cache import caches
+from django.db.models import Min, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import settings as app_settings
+from .models import CsvDownload
+
+logger = logging.getLogger(__name__)
+
+# default for limits that are read from settings at call time - None can't
+# be used for this, as it means "unlimited"
+FROM_SETTINGS: Any = object()
+
+
+class ExportThrottled(Exception):
+    """Raised when an export is refused by admission control."""
+
+    def __init__(self, message: str, retry_after: Optional[int] = None) -> None:
+        super().__init__(message)
+        self.retry_after: int = retry_after or app_settings.RETRY_AFTER
+
+
+class BaseConcurrencyBackend:
+    """Base class for counting the number of slots in use per key."""
+
+    def acquire(self, key: str, limit: int, timeout: float) -> bool:
+        """Take a slot for key, waiting up to timeout secs for one to be free."""
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        """Release a slot previously taken for key."""
+        raise NotImplementedError
+
+
+class LocalConcurrencyBackend(BaseConcurrencyBackend):
+    """In-process backend - limits are per process, not per deployment."""
+
+    def __init__(self) -> None:
+        self.counts: defaultdict = defaultdict(int)
+        self.condition = threading.Condition()
+
+    def acquire(self, key: str, limit: int, timeout: float) -> bool:
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.counts[key] < limit, timeout=timeout
+            ):
+                return False
+            self.counts[key] += 1
+            return True
+
+    def release(self, key: str) -> None:
+        with self.condition:
+            self.counts[key] -= 1
+            if self.counts[key] <= 0:
+                del self.counts[key]
+            self.condition.notify_all()
+
+
+class CacheConcurrencyBackend(BaseConcurrencyBackend):
+    """
+    Distributed backend that counts slots in the Django cache.
+
+    This relies on the cache `incr` / `decr` being atomic (true for the
+    Redis and Memcached backends). Counters expire `slot_ttl` secs after
+    a slot was last taken or released (`incr` / `decr` don't refresh the
+    expiry, so it is refreshed with `touch`), so that slots leaked by a
+    crashed process are eventually recovered. A counter that expired
+    while slots were held is never decremented below zero.
+
+    """
+
+    cache_alias = "default"
+    key_prefix = "django_csv:slots:"
+    slot_ttl = 60 * 60
+    poll_interval = 0.1
+
+    @property
+    def cache(self) -> Any:
+        return caches[self.cache_alias]
+
+    def _try_acquire(self, key: str, limit: int) -> bool:
+        cache_key = self.key_prefix + key
+        self.cache.add(cache_key, 0, self.slot_ttl)
+        try:
+            count = self.cache.incr(cache_key)
+        except ValueError:
+            # counter expired between the add and the incr
+            return False
+        if count > limit:
+            self._decr(cache_key)
+            return False
+        self.cache.touch(cache_key, self.slot_ttl)
+        return True
+
+    def _decr(self, cache_key: str) -> None:
+        count = self.cache.decr(cache_key)
+        if count < 0:
+            # the counter expired (and was reset) while slots were held
+            self.cache.incr(cache_key, -count)
+        self.cache.touch(cache_key, self.slot_ttl)
+
+    def acquire(self, key: str, limit: int, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while not self._try_acquire(key, limit):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def release(self, key: str) -> None:
+        try:
+            self._decr(self.key_prefix + key)
+        except ValueError:
+            logger.debug("Export slot counter '%s' has already expired", key)
+
+
+def _setting(value: Any, name: str) -> Any:
+    """Return value, or the named app setting if it is FROM_SETTINGS."""
+    return getattr(app_settings, name) if value is FROM_SETTINGS else value
+
+
+@functools.lru_cache(maxsize=None)
+def _load_backend(path: str) -> BaseConcurrencyBackend:
+    return import_string(path)()
+
+
+def get_backend(path: Optional[str] = None) -> BaseConcurrencyBackend:
+    """Return the (shared) concurrency backend instance."""
+    return _load_backend(path or app_settings.CONCURRENCY_BACKEND)
+
+
+@contextlib.contextmanager
+def export_slot(
+    user: Any,
+    *,
+    max_concurrent: Optional[int] = FROM_SETTINGS,
+    max_per_user: Optional[int] = FROM_SETTINGS,
+    timeout: float = FROM_SETTINGS,
+    backend: Optional[BaseConcurrencyBackend] = None,
+) -> Generator[None, None, None]:
+    """
+    Hold an export slot for the duration of the block.
+
+    Raises ExportThrottled if a slot cannot be taken within timeout secs.
+    Anonymous users are only subject to the global limit. The per-user slot
+    is taken first, so a user queueing behind their own limit doesn't hold
+    a global slot while they wait. The limits and timeout default to their
+    CSV_DOWNLOAD_* settings.
+
+    """
+    timeout = _setting(timeout, "QUEUE_TIMEOUT")
+    backend = backend or get_backend()
+    limits = []
+    if user and user.is_authenticated:
+        limits.append(
+            (f"user:{user.pk}", _setting(max_per_user, "MAX_CONCURRENT_PER_USER"))
+        )
+    limits.append(("global", _setting(max_concurrent, "MAX_CONCURRENT")))
+    held: List[str] = []
+    try:
+        for key, limit in limits:
+            if limit is None:
+                continue
+            if not backend.acquire(key, limit, timeout):
+                raise ExportThrottled(f"Too many concurrent exports ({key}).")
+            held.append(key)
+        yield
+    finally:
+        for key in reversed(held):
+            backend.release(key)
+
+
+def check_row_quota(
+    user: Any, quota: Optional[int] = FROM_SETTINGS, period: Optional[int] = None
+) -> None:
+    """
+    Raise ExportThrottled if user has used up their row quota.
+
+    The quota is checked with a single aggregate over the user's downloads
+    in the period (using the user/timestamp index), and the Retry-After
+    is set to when the oldest of those drops out of the period. The quota
+    and period default to their CSV_DOWNLOAD_* settings.
+
+    """
+    quota = _setting(quota, "ROW_QUOTA")
+    if quota is None or not (user and user.is_authenticated):
+        return
+    period = period or app_settings.ROW_QUOTA_PERIOD
+    now = timezone.now()
+    usage = CsvDownload.objects.filter(
+        user=user, timestamp__gte=now - timedelta(seconds=period)
+    ).aggregate(rows=Sum("row_count"), since=Min("timestamp"))
+    if (usage["rows"] or 0) < quota:
+        return
+    retry_after = usage["since"] + timedelta(seconds=period) - now
+    raise ExportThrottled(
+        f"Row quota of {quota} rows exceeded.",
+        retry_after=max(int(retry_after.total_seconds()), 1),
+    )
@@ -1,14 +1,45 @@
-from typing import Any, List, Type
+import datetime
+from typing import (
+    Any,
+    ContextManager,
+    Generator,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
+from django.core.files.storage import Storage
 from django.db.models.query import QuerySet
-from django.http import HttpRequest, HttpResponse
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBadRequest,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django.views import View
 
-from .csv import BaseQuerySetWriter, BulkQuerySetWriter, write_csv
+from . import settings as app_settings
+from .archive import ArchiveMember, stream_csv_archive
+from .columns import Column, column_names
+from .csv import (
+    BaseQuerySetWriter,
+    BulkQuerySetWriter,
+    RowQuerySetWriter,
+    write_csv,
+)
+from .estimate import Estimate, estimate_export
 from .models import CsvDownload
-from .settings import MAX_ROWS
+from .rollup import rollups_between, usage_summary
+from .serve import get_storage, serve_stored_csv
+from .singleflight import download_csv_coalesced
+from .throttle import ExportThrottled, check_row_quota, export_slot
 from .types import OptionalSequence
 
 
@@ -16,14 +47,23 @@ def download_csv(
     user: settings.AUTH_USER_MODEL,
     filename: str,
     queryset: QuerySet,
-    *columns: str,
+    *columns: Column,
     header: bool = True,
-    max_rows: int = MAX_ROWS,
+    max_rows: Optional[int] = None,
     column_headers: OptionalSequence = None,
     writer_klass: Type[BaseQuerySetWriter] = BulkQuerySetWriter,
+    using: Optional[str] = None,
+    statement_timeout: Optional[int] = None,
     **writer_kwargs: Any,
 ) -> HttpResponse:
-    """Download queryset as a CSV."""
+    """
+    Download queryset as a CSV.
+
+    The queryset is run against the `using` database alias, but the
+    CsvDownload is always written via the database router (i.e. to the
+    primary).
+
+    """
     response = HttpResponse(content_type="text/csv")
     response["Content-Disposition"] = f'attachment; filename="{filename}"'
     row_count = write_csv(
@@ -34,6 +74,8 @@ def download_csv(
         max_rows=max_rows,
         column_headers=column_headers,
         writer_klass=writer_klass,
+        using=using,
+        statement_timeout=statement_timeout,
         **writer_kwargs,
     )
     response["X-Row-Count"] = row_count
@@ -41,19 +83,69 @@ def download_csv(
         user=user,
         row_count=row_count,
         filename=filename,
-        columns=", ".join(columns),
+        columns=", ".join(column_names(columns)),
     )
     return response
 
 
+def download_csv_archive(
+    user: settings.AUTH_USER_MODEL,
+    filename: str,
+    members: Iterable[ArchiveMember],
+    *,
+    header: bool = True,
+    max_rows: Optional[int] = None,
+    **writer_kwargs: Any,
+) -> StreamingHttpResponse:
+    """
+    Download multiple querysets as CSVs in a single streamed ZIP archive.
+
+    Each member is a (name, queryset, columns) tuple. The download is
+    recorded as a single CsvDownload once the archive has been streamed,
+    with the total row count across all members, and the columns of
+    each member recorded against its name.
+
+    """
+    members = list(members)
+
+    def _stream() -> Generator[bytes, None, None]:
+        row_counts = yield from stream_csv_archive(
+            members, header=header, max_rows=max_rows, **writer_kwargs
+        )
+        CsvDownload.objects.create(
+            user=user,
+            row_count=sum(row_counts.values()),
+            filename=filename,
+            columns="; ".join(
+                f"{name}: {', '.join(column_names(columns))}"
+                for name, _, columns in members
+            ),
+        )
+
+    response = StreamingHttpResponse(_stream(), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
 class CsvDownloadView(View):
     """CBV for downloading CSVs."""
 
-    writer_klass = BulkQuerySetWriter
+    # set to None to pick the writer from the pre-flight estimate
+    writer_klass: Optional[Type[BaseQuerySetWriter]] = BulkQuerySetWriter
+    # estimate the size of the export before running it
+    preflight = False
+    # if preflight, reject downloads that would be truncated at max_rows
+    reject_truncated = False
+    # if preflight, estimated row count above which export_in_background is used
+    background_threshold: Optional[int] = None
+    # query param that staff can set (e.g. "?profile=1") to profile the export
+    profile_query_param = "profile"
+    # share the export between concurrent identical requests (via storage)
+    coalesce = False
 
     def get_writer_klass(self) -> Type[BaseQuerySetWriter]:
         # Override to provide a different writer
-        return self.writer_klass
+        return self.writer_klass or BulkQuerySetWriter
 
     def get_writer_kwargs(self) -> dict:
         # custom kwargs for initialising the writer
@@ -65,7 +157,27 @@ class CsvDownloadView(View):
 
     def get_max_rows(self, request: HttpRequest) -> int:
         """Override to set custom MAX_ROWS on a per-request basis."""
-        return MAX_ROWS
+        return app_settings.MAX_ROWS
+
+    def get_using(self, request: HttpRequest) -> Optional[str]:
+        """Override to run the export against a specific database alias."""
+        return app_settings.EXPORT_DB_ALIAS
+
+    def get_statement_timeout(self, request: HttpRequest) -> Optional[int]:
+        """Override to set a custom statement timeout (ms) per request."""
+        return app_settings.STATEMENT_TIMEOUT
+
+    def get_profile(self, request: HttpRequest) -> Optional[bool]:
+        """
+        Return True to profile the export's encoder (see ProfilingEncoder).
+
+        Staff users can turn profiling on with the `profile_query_param`,
+        otherwise returns None, and CSV_DOWNLOAD_PROFILE decides.
+
+        """
+        if request.GET.get(self.profile_query_param) and request.user.is_staff:
+            return True
+        return None
 
     def add_header(self, request: HttpRequest) -> bool:
         """Return True to include header row in CSV."""
@@ -86,31 +198,216 @@ class CsvDownloadView(View):
         """Return download filename."""
         raise NotImplementedError
 
-    def get_columns(self, request: HttpRequest) -> List[str]:
+    def get_columns(self, request: HttpRequest) -> List[Column]:
         """Return columns to extract from the queryset."""
         raise NotImplementedError
 
     def get_column_headers(self, request: HttpRequest) -> List[str]:
         """Return column headers to apply to the CSV."""
-        return self.get_columns(request)
+        return column_names(self.get_columns(request))
 
     def get_queryset(self, request: HttpRequest) -> QuerySet:
         """Return the data to be downloaded."""
         raise NotImplementedError
 
+    def check_admission(self, request: HttpRequest) -> None:
+        """
+        Raise ExportThrottled if the user has exceeded their row quota.
+
+        Override to apply a custom quota, or to disable the check.
+
+        """
+        check_row_quota(self.get_user(request))
+
+    def get_export_slot(self, request: HttpRequest) -> ContextManager:
+        """
+        Return context manager that holds an export slot for the download.
+
+        Override to apply custom concurrency limits - see `export_slot`.
+
+        """
+        return export_slot(self.get_user(request))
+
+    def throttled(
+        self, request: HttpRequest, exception: ExportThrottled
+    ) -> HttpResponse:
+        """Return the response sent when the download is throttled."""
+        response = HttpResponse(str(exception), status=429, content_type="text/plain")
+        response["Retry-After"] = exception.retry_after
+        return response
+
     def get(self, request: HttpRequest) -> HttpResponse:
         """Download data as CSV."""
         if not self.has_permission(request):
             raise PermissionDenied
 
-        return download_csv(
+        try:
+            self.check_admission(request)
+            with self.get_export_slot(request):
+                return self.download(request)
+        except ExportThrottled as ex:
+            return self.throttled(request, ex)
+
+    def get_estimate(self, request: HttpRequest, queryset: QuerySet) -> Estimate:
+        """Return the pre-flight size estimate for the download."""
+        return estimate_export(
+            queryset,
+            *self.get_columns(request),
+            max_rows=self.get_max_rows(request),
+        )
+
+    def check_estimate(
+        self, request: HttpRequest, estimate: Estimate
+    ) -> Optional[HttpResponse]:
+        """Return a response to send instead of the download, if required."""
+        if self.reject_truncated and estimate.truncated:
+            return self.export_too_large(request, estimate)
+        if self.background_threshold is not None:
+            if estimate.rows > self.background_threshold:
+                return self.export_in_background(request, estimate)
+        return None
+
+    def select_writer_klass(
+        self, request: HttpRequest, estimate: Estimate
+    ) -> Type[BaseQuerySetWriter]:
+        """
+        Return the writer to use, based on the pre-flight estimate.
+
+        If the writer_klass is set it is always used, otherwise small exports
+        are written in batches (BulkQuerySetWriter), and large ones row by
+        row (RowQuerySetWriter).
+
+        """
+        if self.writer_klass:
+            return self.get_writer_klass()
+        if min(estimate.rows, estimate.max_rows) <= app_settings.DEFAULT_PAGE_SIZE:
+            return BulkQuerySetWriter
+        return RowQuerySetWriter
+
+    def export_too_large(
+        self, request: HttpRequest, estimate: Estimate
+    ) -> HttpResponse:
+        """Return the response sent when the download would be truncated."""
+        return HttpResponse(
+            f"Export would be truncated at {estimate.max_rows} rows.",
+            status=413,
+            content_type="text/plain",
+        )
+
+    def export_in_background(
+        self, request: HttpRequest, estimate: Estimate
+    ) -> HttpResponse:
+        """
+        Hand the export off to a background process.
+
+        Override to queue the export (using whatever task runner you have)
+        and return a response (e.g. 202 Accepted) to tell the user.
+
+        """
+        raise NotImplementedError
+
+    def download(self, request: HttpRequest) -> HttpResponse:
+        """Return the CSV download response."""
+        queryset = self.get_queryset(request)
+        if using := self.get_using(request):
+            queryset = queryset.using(using)
+        writer_klass = self.get_writer_klass()
+        if self.preflight:
+            estimate = self.get_estimate(request, queryset)
+            if response := self.check_estimate(request, estimate):
+                return response
+            writer_klass = self.select_writer_klass(request, estimate)
+        download_func = download_csv_coalesced if self.coalesce else download_csv
+        return download_func(
             self.get_user(request),
             self.get_filename(request),
-            self.get_queryset(request),
+            queryset,
             *self.get_columns(request),
             header=self.add_header(request),
             max_rows=self.get_max_rows(request),
             column_headers=self.get_column_headers(request),
-            writer_klass=self.get_writer_klass(),
-            **self.get_writer_kwargs(),
+            writer_klass=writer_klass,
+            using=using,
+            statement_timeout=self.get_statement_timeout(request),
+            **{"profile": self.get_profile(request), **self.get_writer_kwargs()},
         )
+
+
+class StoredCsvDownloadView(View):
+    """
+    CBV for (re-)downloading exports that have been written to storage.
+
+    Supports conditional and range requests, so interrupted downloads
+    can be resumed without recomputing the export. The URL must include
+    the CsvDownload `pk`.
+
+    """
+
+    def get_storage(self) -> Storage:
+        """Return the storage the exports were written to."""
+        return get_storage()
+
+    def get_user(self, request: HttpRequest) -> settings.AUTH_USER_MODEL:
+        """Return the user against whom to record the download."""
+        return request.user if request.user.is_authenticated else None
+
+    def has_permission(self, request: HttpRequest, download: CsvDownload) -> bool:
+        """Return True if the user has permission to download this file."""
+        return request.user.is_authenticated and download.user_id == request.user.pk
+
+    def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        download = get_object_or_404(
+            CsvDownload.objects.exclude(storage_name=""), pk=pk
+        )
+        if not self.has_permission(request, download):
+            raise PermissionDenied
+        return serve_stored_csv(
+            request, download, storage=self.get_storage(), user=self.get_user(request)
+        )
+
+
+class CsvDownloadUsageView(View):
+    """
+    CBV for download usage analytics, as JSON.
+
+    Returns the totals, daily trend, top users and largest exports between
+    the "start" and "end" query params (ISO dates, inclusive), read from
+    the daily rollups - so it only includes downloads that have been
+    rolled up (see `rollup_csv_downloads`). Defaults to the last
+    `default_days` days.
+
+    """
+
+    default_days = 30
+    # longest date range that can be requested
+    max_days = 366
+    # number of top users / filenames returned
+    limit = 10
+
+    def has_permission(self, request: HttpRequest) -> bool:
+        """Return True if the user has permission to see usage."""
+        return request.user.is_staff
+
+    def get_date_range(
+        self, request: HttpRequest
+    ) -> Tuple[datetime.date, datetime.date]:
+        """Return the (start, end) dates, raising ValueError if invalid."""
+        end = timezone.localdate()
+        if value := request.GET.get("end"):
+            end = datetime.date.fromisoformat(value)
+        start = end - datetime.timedelta(days=self.default_days - 1)
+        if value := request.GET.get("start"):
+            start = datetime.date.fromisoformat(value)
+        if not 0 <= (end - start).days < self.max_days:
+            raise ValueError(f"Date range must be 1 to {self.max_days} days.")
+        return start, end
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        if not self.has_permission(request):
+            raise PermissionDenied
+        try:
+            start, end = self.get_date_range(request)
+        except ValueError as ex:
+            return HttpResponseBadRequest(str(ex), content_type="text/plain")
+        summary = usage_summary(rollups_between(start, end), limit=self.limit)
+        return JsonResponse({"start": start, "end": end, **summary._asdict()})
@@ -2,16 +2,19 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User
 
+from django_csv.admin import CsvExportAdminMixin
 from django_csv.views import download_csv
 
 admin.site.unregister(User)
 
 
 @admin.register(User)
-class CustomUserAdmin(UserAdmin):
+class CustomUserAdmin(CsvExportAdminMixin, UserAdmin):
     actions = ["download", "download_without_header", "download_with_custom_header"]
     csv_fields = ("first_name", "last_name", "email", "is_staff")
     csv_header = ("given name", "family name", "email", "is_staff")
+    csv_export_columns = ("username", "email", "is_staff")
+    csv_export_filename = "users.csv"
 
     @admin.action(description="Download users (default)")
     def download(self, request, queryset):
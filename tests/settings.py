@@ -8,7 +8,12 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": "django_csv_downloads.db",
-    }
+    },
+    # only used by tests that ask for it, e.g. to simulate a lagging replica
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": "django_csv_downloads_replica.db",
+    },
 }
 
 INSTALLED_APPS = (
@@ -0,0 +1,106 @@
+from unittest import mock
+
+import pytest
+from django.contrib.admin import helpers, site
+from django.contrib.admin.options import IS_POPUP_VAR
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.urls import reverse
+
+from django_csv.models import CsvDownload, CsvDownloadRollup
+from tests.admin import CustomUserAdmin
+
+
+@pytest.mark.django_db
+class TestCsvExportAdminMixin:
+    @pytest.fixture
+    def admin_user(self, client):
+        user = User.objects.create_superuser("admin", "admin@example.com", "pass")
+        client.force_login(user)
+        return user
+
+    def export(self, client, **data):
+        return client.post(
+            reverse("admin:auth_user_changelist"),
+            {"action": "export_csv", **data},
+        )
+
+    def test_export_csv(self, client, admin_user):
+        user = User.objects.create_user("user1", "user1@example.com")
+        User.objects.create_user("user2")
+        response = self.export(client, **{helpers.ACTION_CHECKBOX_NAME: [user.pk]})
+        assert response.streaming
+        assert response["Content-Disposition"] == 'attachment; filename="users.csv"'
+        assert not CsvDownload.objects.exists()
+        content = b"".join(response.streaming_content)
+        assert (
+            content == b"username,email,is_staff\r\nuser1,user1@example.com,False\r\n"
+        )
+        download = CsvDownload.objects.get()
+        assert download.user == admin_user
+        assert download.row_count == 1
+        assert download.columns == "username, email, is_staff"
+
+    def test_export_csv__select_across(self, client, admin_user):
+        for i in range(3):
+            User.objects.create_user(f"user{i}")
+        response = self.export(
+            client,
+            select_across=1,
+            **{helpers.ACTION_CHECKBOX_NAME: [admin_user.pk]},
+        )
+        assert len(b"".join(response.streaming_content).splitlines()) == 5
+        assert CsvDownload.objects.get().row_count == 4
+
+    @mock.patch.object(CustomUserAdmin, "csv_export_background_threshold", 1)
+    @mock.patch.object(CustomUserAdmin, "export_csv_in_background")
+    def test_export_csv__background(self, mock_background, client, admin_user):
+        mock_background.return_value = HttpResponse(status=202)
+        User.objects.create_user("user1")
+        response = self.export(
+            client,
+            select_across=1,
+            **{helpers.ACTION_CHECKBOX_NAME: [admin_user.pk]},
+        )
+        assert response.status_code == 202
+        assert mock_background.call_args.args[1].count() == 2
+        assert not CsvDownload.objects.exists()
+
+    def test_get_actions(self, rf, admin_user):
+        request = rf.get("/")
+        request.user = admin_user
+        model_admin = CustomUserAdmin(User, site)
+        assert "export_csv" in model_admin.get_actions(request)
+        request.user = User.objects.create_user("user1", is_staff=True)
+        assert "export_csv" not in model_admin.get_actions(request)
+
+    def test_get_actions__disabled(self, rf, admin_user):
+        request = rf.get("/")
+        request.user = admin_user
+        model_admin = CustomUserAdmin(User, site)
+        model_admin.actions = None
+        assert model_admin.get_actions(request) == {}
+
+    def test_get_actions__popup(self, rf, admin_user):
+        request = rf.get("/", {IS_POPUP_VAR: "1"})
+        request.user = admin_user
+        model_admin = CustomUserAdmin(User, site)
+        assert model_admin.get_actions(request) == {}
+
+
+@pytest.mark.django_db
+def test_rollup_admin__usage(client):
+    user = User.objects.create_superuser("admin", "admin@example.com", "pass")
+    client.force_login(user)
+    CsvDownloadRollup.objects.create(
+        date="2024-01-01", user=user, filename="big-export.csv", download_count=2
+    )
+    response = client.get(reverse("admin:django_csv_csvdownloadrollup_changelist"))
+    assert response.status_code == 200
+    assert response.context["usage"].totals["downloads"] == 2
+    assert b"Largest exports" in response.content
+    # invalid filters redirect, without a summary
+    response = client.get(
+        reverse("admin:django_csv_csvdownloadrollup_changelist"), {"foo": "bar"}
+    )
+    assert response.status_code == 302
@@ -0,0 +1,52 @@
+import io
+import zipfile
+
+import pytest
+from django.contrib.auth.models import Group, User
+
+from django_csv import archive
+
+
+def _consume(generator):
+    chunks = []
+    while True:
+        try:
+            chunks.append(next(generator))
+        except StopIteration as ex:
+            return b"".join(chunks), ex.value
+
+
+@pytest.mark.django_db
+def test_stream_csv_archive():
+    User.objects.create_user("user1", first_name="Fred")
+    User.objects.create_user("user2", first_name="Ginger")
+    Group.objects.create(name="group1")
+    members = [
+        ("users.csv", User.objects.order_by("id"), ("username", "first_name")),
+        ("groups.csv", Group.objects.all(), ("name",)),
+    ]
+    data, row_counts = _consume(archive.stream_csv_archive(members))
+    assert row_counts == {"users.csv": 2, "groups.csv": 1}
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.namelist() == ["users.csv", "groups.csv"]
+        assert zf.read("users.csv").decode() == (
+            "username,first_name\r\nuser1,Fred\r\nuser2,Ginger\r\n"
+        )
+        assert zf.read("groups.csv").decode() == "name\r\ngroup1\r\n"
+        # streamed members must use data descriptors (bit 3)
+        assert all(info.flag_bits & 0x08 for info in zf.infolist())
+
+
+@pytest.mark.django_db
+def test_stream_csv_archive__chunked():
+    for i in range(50):
+        User.objects.create_user(f"user{i}")
+    members = [("users.csv", User.objects.all(), ("username",))]
+    chunks = list(
+        archive.stream_csv_archive(
+            members, chunk_size=1, compression=zipfile.ZIP_STORED
+        )
+    )
+    assert len(chunks) > 50
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+        assert len(zf.read("users.csv").splitlines()) == 51
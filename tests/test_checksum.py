@@ -0,0 +1,40 @@
+import base64
+import hashlib
+import io
+
+from django_csv import checksum
+
+DATA = b"username\r\nuser1\r\n"
+
+
+def test_checksum():
+    result = checksum.Checksum()
+    result.update(DATA[:5])
+    result.update(DATA[5:])
+    assert result.size == len(DATA)
+    assert result.md5 == hashlib.md5(DATA).hexdigest()  # noqa: S324
+    assert result.sha256 == hashlib.sha256(DATA).hexdigest()
+    md5 = hashlib.md5(DATA)  # noqa: S324
+    assert base64.b64decode(result.content_md5) == md5.digest()
+    assert base64.b64decode(result.checksum_sha256) == hashlib.sha256(DATA).digest()
+    assert result.as_fields() == {
+        "md5": result.md5,
+        "sha256": result.sha256,
+        "byte_count": len(DATA),
+    }
+
+
+def test_checksum_writer():
+    fileobj = io.BytesIO()
+    with io.TextIOWrapper(
+        checksum.ChecksumWriter(fileobj),
+        encoding="utf-8",
+        newline="",
+        write_through=True,
+    ) as buffer:
+        buffer.write(DATA.decode())
+        result = checksum.get_checksum(buffer)
+        # the underlying fileobj is left open
+    assert not fileobj.closed
+    assert fileobj.getvalue() == DATA
+    assert result.sha256 == hashlib.sha256(DATA).hexdigest()
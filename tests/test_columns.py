@@ -0,0 +1,110 @@
+from io import StringIO
+
+import pytest
+from django.contrib.auth.models import Group, User
+from django.db.models import Count, F
+
+from django_csv import csv
+from django_csv.columns import AnnotationColumn, BatchColumn, ColumnPlan, column_names
+from django_csv.models import CsvDownload
+
+WRITERS = (
+    (csv.BulkQuerySetWriter, {"batch_size": 2}),
+    (csv.PagedQuerySetWriter, {"page_size": 2}),
+    (csv.KeysetQuerySetWriter, {"page_size": 2}),
+    (csv.RowQuerySetWriter, {}),
+)
+
+
+@pytest.fixture
+def users():
+    group = Group.objects.create(name="group")
+    users = [User.objects.create_user(f"user{i}") for i in range(5)]
+    users[0].groups.add(group)
+    for i, user in enumerate(users[:3]):
+        for j in range(i + 1):
+            CsvDownload.objects.create(user=user, filename=f"{i}-{j}.csv", row_count=0)
+    return users
+
+
+def download_count():
+    return BatchColumn.aggregate(
+        "downloads", CsvDownload.objects.all(), "user", Count("id"), default=0
+    )
+
+
+def last_download():
+    return BatchColumn.lookup(
+        "last_download", CsvDownload.objects.order_by("id"), "user", "filename"
+    )
+
+
+def test_column_names():
+    columns = ("username", AnnotationColumn("n", Count("groups")), download_count())
+    assert column_names(columns) == ["username", "n", "downloads"]
+
+
+def test_column_plan():
+    plan = ColumnPlan(("username", download_count(), AnnotationColumn("n", F("id"))))
+    assert plan.fields == ["username", "n", "pk"]
+    assert list(plan.annotations) == ["n"]
+    assert plan.resolve([]) == []
+
+
+def test_column_plan__no_batch_columns():
+    plan = ColumnPlan(("username", "email"))
+    rows = [("user1", "")]
+    assert plan.fields == ["username", "email"]
+    assert plan.resolve(rows) is rows
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("klass,kwargs", WRITERS)
+def test_write_csv__columns(django_assert_max_num_queries, users, klass, kwargs):
+    columns = (
+        "username",
+        AnnotationColumn("group_count", Count("groups")),
+        download_count(),
+        last_download(),
+    )
+    csvfile = StringIO()
+    # one query for each batch of 2 rows, plus one per batch column - the
+    # RowQuerySetWriter fetches the batch columns for chunks of rows instead
+    with django_assert_max_num_queries(9):
+        row_count = csv.write_csv(
+            csvfile,
+            User.objects.order_by("id"),
+            *columns,
+            writer_klass=klass,
+            **kwargs,
+        )
+    assert row_count == 5
+    assert csvfile.getvalue().splitlines() == [
+        "username,group_count,downloads,last_download",
+        "user0,1,1,0-0.csv",
+        "user1,0,2,1-1.csv",
+        "user2,0,3,2-2.csv",
+        "user3,0,0,",
+        "user4,0,0,",
+    ]
+
+
+@pytest.mark.django_db
+def test_batch_column__query_count(django_assert_num_queries, users):
+    csvfile = StringIO()
+    writer = csv.PagedQuerySetWriter(
+        csvfile, User.objects.order_by("id"), "username", download_count(), page_size=2
+    )
+    # 3 pages, each with one query for the rows and one for the batch column
+    with django_assert_num_queries(6):
+        assert writer.write_rows() == 5
+
+
+@pytest.mark.django_db
+def test_batch_column__key(users):
+    column = BatchColumn(
+        "name", lambda keys: {key: key.upper() for key in keys}, key="username"
+    )
+    csvfile = StringIO()
+    csv.write_csv(csvfile, User.objects.order_by("id")[:2], "id", column, header=False)
+    assert csvfile.getvalue() == f"{users[0].id},USER0\r\n{users[1].id},USER1\r\n"
@@ -1,10 +1,12 @@
 from io import StringIO
+from unittest import mock
 
 import pytest
 from django.contrib.auth.models import User
 from django.http import HttpResponse
+from django.test import override_settings
 
-from django_csv import csv
+from django_csv import csv, settings as app_settings
 
 
 class TestBaseQuerySetWriter:
@@ -16,7 +18,16 @@ class TestBaseQuerySetWriter:
         assert writer.columns == columns
         assert writer.queryset == qs
         assert writer.columns == columns
-        assert writer.max_rows == csv.MAX_ROWS
+        assert writer.max_rows == app_settings.MAX_ROWS
+
+    def test_init__override_settings(self):
+        with override_settings(
+            CSV_DOWNLOAD_MAX_ROWS=5, CSV_DOWNLOAD_DB_ALIAS="replica"
+        ):
+            writer = csv.BulkQuerySetWriter(StringIO(), User.objects.all())
+        assert writer.max_rows == 5
+        assert writer.queryset.db == "replica"
+        assert writer.batch_size == 2000
 
     @pytest.mark.django_db
     def test_write_header(self):
@@ -33,7 +44,12 @@ class TestBaseQuerySetWriter:
     @pytest.mark.django_db
     @pytest.mark.parametrize(
         "klass",
-        (csv.BulkQuerySetWriter, csv.PagedQuerySetWriter, csv.RowQuerySetWriter),
+        (
+            csv.BulkQuerySetWriter,
+            csv.PagedQuerySetWriter,
+            csv.KeysetQuerySetWriter,
+            csv.RowQuerySetWriter,
+        ),
     )
     def test_write_rows(self, klass):
         user1 = User.objects.create_user("user1")
@@ -109,3 +125,122 @@ def test_write_csv__column_headers__mismatch():
             *columns,
             column_headers=column_headers,
         )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "klass,writer_kwargs,batch_count",
+    (
+        (csv.BulkQuerySetWriter, {}, 1),
+        (csv.BulkQuerySetWriter, {"batch_size": 1}, 2),
+        (csv.PagedQuerySetWriter, {"page_size": 1}, 2),
+        (csv.KeysetQuerySetWriter, {"page_size": 1}, 2),
+        (csv.RowQuerySetWriter, {}, 2),
+    ),
+)
+def test_iter_write_csv(klass, writer_kwargs, batch_count):
+    User.objects.create_user("user1")
+    User.objects.create_user("user2")
+    csvfile = StringIO()
+    writes = csv.iter_write_csv(
+        csvfile,
+        User.objects.order_by("id"),
+        "username",
+        writer_klass=klass,
+        **writer_kwargs,
+    )
+    batches = []
+    with pytest.raises(StopIteration) as ex:
+        while True:
+            batches.append(next(writes))
+    assert len(batches) == batch_count
+    assert sum(batches) == ex.value.value == 2
+    assert csvfile.getvalue() == "username\r\nuser1\r\nuser2\r\n"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("chunk_size,chunk_count", [(1, 2), (1024, 1)])
+def test_stream_csv(chunk_size, chunk_count):
+    User.objects.create_user("user1")
+    User.objects.create_user("user2")
+    chunks = list(
+        csv.stream_csv(User.objects.order_by("id"), "username", chunk_size=chunk_size)
+    )
+    assert len(chunks) == chunk_count
+    assert b"".join(chunks) == b"username\r\nuser1\r\nuser2\r\n"
+
+
+def test_writer__using():
+    writer = csv.BulkQuerySetWriter(StringIO(), User.objects.all(), using="replica")
+    assert writer.queryset.db == "replica"
+
+
+@pytest.mark.django_db
+@mock.patch("django_csv.csv.db.statement_timeout")
+def test_write_csv__statement_timeout(mock_timeout):
+    csv.write_csv(StringIO(), User.objects.all(), "username", statement_timeout=500)
+    mock_timeout.assert_called_once_with("default", 500)
+
+
+@pytest.mark.django_db
+def test_paged_writer__no_count(django_assert_num_queries):
+    for i in range(5):
+        User.objects.create_user(f"user{i}")
+    csvfile = StringIO()
+    writer = csv.PagedQuerySetWriter(
+        csvfile, User.objects.order_by("id"), "username", page_size=2, max_rows=4
+    )
+    # two full pages, stopping at max_rows - no COUNT(*) query
+    with django_assert_num_queries(2):
+        assert list(writer.write_batches()) == [2, 2]
+    assert csvfile.getvalue() == "user0\r\nuser1\r\nuser2\r\nuser3\r\n"
+
+
+@pytest.mark.django_db
+def test_bulk_writer__batches(django_assert_num_queries):
+    for i in range(5):
+        User.objects.create_user(f"user{i}")
+    csvfile = StringIO()
+    writer = csv.BulkQuerySetWriter(
+        csvfile, User.objects.order_by("id"), "username", batch_size=2, max_rows=4
+    )
+    # a single query, written out in batches - no COUNT(*) query
+    with django_assert_num_queries(1):
+        assert list(writer.write_batches()) == [2, 2]
+    assert writer.queryset._result_cache is None
+    assert csvfile.getvalue() == "user0\r\nuser1\r\nuser2\r\nuser3\r\n"
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "max_rows,batches,query_count",
+    ((4, [2, 2], 2), (5, [2, 2, 1], 3), (10, [2, 2, 1], 3)),
+)
+def test_keyset_writer(django_assert_num_queries, max_rows, batches, query_count):
+    for i in range(5):
+        User.objects.create_user(f"user{i}")
+    csvfile = StringIO()
+    writer = csv.KeysetQuerySetWriter(
+        csvfile,
+        User.objects.order_by("-username"),
+        "username",
+        page_size=2,
+        max_rows=max_rows,
+    )
+    # written in pk order (not the queryset ordering), without the pk column
+    with django_assert_num_queries(query_count):
+        assert list(writer.write_batches()) == batches
+    usernames = [f"user{i}" for i in range(sum(batches))]
+    assert csvfile.getvalue() == "".join(f"{u}\r\n" for u in usernames)
+
+
+@pytest.mark.django_db
+def test_keyset_writer__start_after():
+    users = [User.objects.create_user(f"user{i}") for i in range(3)]
+    csvfile = StringIO()
+    writer = csv.KeysetQuerySetWriter(
+        csvfile, User.objects.all(), "username", start_after=users[0].pk
+    )
+    assert writer.write_rows() == 2
+    assert writer.last_pk == users[-1].pk
+    assert csvfile.getvalue() == "user1\r\nuser2\r\n"
@@ -0,0 +1,82 @@
+from unittest import mock
+
+import pytest
+
+from django_csv import db
+
+
+def _connection(vendor, is_mariadb=False, previous=0):
+    connection = mock.MagicMock(vendor=vendor, mysql_is_mariadb=is_mariadb)
+    cursor = connection.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (previous,)
+    return connection, cursor
+
+
+@pytest.mark.parametrize("timeout", (None, 0))
+def test_statement_timeout__disabled(timeout):
+    connection, cursor = _connection("postgresql")
+    with mock.patch.object(db, "connections", {"default": connection}):
+        with db.statement_timeout("default", timeout):
+            pass
+    assert cursor.execute.call_count == 0
+
+
+SET_TIMEOUT = "SELECT set_config('statement_timeout', %s, true)"
+
+
+@mock.patch("django_csv.db.transaction")
+def test_statement_timeout__postgresql(mock_transaction):
+    connection, cursor = _connection("postgresql", previous="0")
+    with mock.patch.object(db, "connections", {"replica": connection}):
+        with db.statement_timeout("replica", 5000):
+            assert cursor.execute.call_args == mock.call(SET_TIMEOUT, ["5000"])
+    mock_transaction.atomic.assert_called_once_with(using="replica")
+    # restored, as the block may be a savepoint in an outer transaction
+    assert cursor.execute.call_args_list == [
+        mock.call("SELECT current_setting('statement_timeout')"),
+        mock.call(SET_TIMEOUT, ["5000"]),
+        mock.call(SET_TIMEOUT, ["0"]),
+    ]
+
+
+@mock.patch("django_csv.db.transaction")
+def test_statement_timeout__postgresql_nested(mock_transaction):
+    """Check the outer transaction's timeout is restored after the block."""
+    connection, cursor = _connection("postgresql", previous="30s")
+    with mock.patch.object(db, "connections", {"default": connection}):
+        with mock_transaction.atomic(using="default"):
+            with db.statement_timeout("default", 5000):
+                pass
+            assert cursor.execute.call_args == mock.call(SET_TIMEOUT, ["30s"])
+
+
+@mock.patch("django_csv.db.transaction")
+def test_statement_timeout__postgresql_error(mock_transaction):
+    # the (aborted) transaction is rolled back, which restores the timeout
+    connection, cursor = _connection("postgresql", previous="0")
+    with mock.patch.object(db, "connections", {"default": connection}):
+        with pytest.raises(ValueError):
+            with db.statement_timeout("default", 5000):
+                raise ValueError("boom")
+    assert cursor.execute.call_args == mock.call(SET_TIMEOUT, ["5000"])
+
+
+@pytest.mark.parametrize(
+    "is_mariadb,variable,value",
+    ((False, "max_execution_time", 5000), (True, "max_statement_time", 5)),
+)
+def test_statement_timeout__mysql(is_mariadb, variable, value):
+    connection, cursor = _connection("mysql", is_mariadb=is_mariadb, previous=0)
+    with mock.patch.object(db, "connections", {"default": connection}):
+        with db.statement_timeout("default", 5000):
+            assert cursor.execute.call_args == mock.call(
+                f"SET SESSION {variable} = %s", [value]
+            )
+    assert cursor.execute.call_args == mock.call(f"SET SESSION {variable} = %s", [0])
+
+
+@pytest.mark.django_db
+def test_statement_timeout__unsupported():
+    # sqlite does not support timeouts - this should be a no-op
+    with db.statement_timeout("default", 5000):
+        pass
@@ -0,0 +1,162 @@
+import csv as stdlib_csv
+import datetime
+import decimal
+import logging
+import uuid
+from io import StringIO
+
+import pytest
+from django.contrib.auth.models import User
+from django.test import override_settings
+
+from django_csv import csv, encoders
+
+
+class CommaInt(int):
+    """int subclass whose str() needs quoting."""
+
+    def __str__(self):
+        return f"{int(self):,}"
+
+
+ROWS = [
+    (
+        1,
+        "plain",
+        'with "quotes"',
+        "with, comma",
+        "multi\nline",
+        1.5,
+        decimal.Decimal("2.50"),
+        True,
+        datetime.date(2024, 1, 2),
+        datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+        uuid.UUID(int=1),
+        None,
+        datetime.timedelta(days=1),
+        datetime.time(3, 4, 5),
+        CommaInt(1234),
+    ),
+    (
+        None,
+        "",
+        "",
+        "",
+        "\r",
+        -0.1,
+        None,
+        False,
+        None,
+        None,
+        None,
+        "late, str",
+        datetime.timedelta(days=-2, seconds=5),
+        None,
+        CommaInt(5),
+    ),
+    # values that don't match the type detected from the first row
+    ("one", 2, 3, 4, 5, 6, "7,8", None, "", 0, "x", 1, "2 days", 3, 4),
+]
+
+
+def _stdlib(rows):
+    output = StringIO()
+    stdlib_csv.writer(output).writerows(rows)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("klass", (encoders.CsvRowEncoder, encoders.FastRowEncoder))
+def test_encoder__matches_stdlib(klass):
+    output = StringIO()
+    encoder = klass(output)
+    encoder.writerow(("a", "b,c"))
+    encoder.writerows(ROWS[:2])
+    encoder.writerows(ROWS[2:])
+    encoder.writerows([])
+    encoder.close()
+    assert output.getvalue() == _stdlib([("a", "b,c"), *ROWS])
+
+
+@pytest.mark.parametrize("row", ([""], [None], ["", ""], [None, None]))
+def test_fast_encoder__empty_fields(row):
+    output = StringIO()
+    encoders.FastRowEncoder(output).writerows([row])
+    assert output.getvalue() == _stdlib([row])
+
+
+def test_fast_encoder__detect():
+    encoder = encoders.FastRowEncoder(StringIO())
+    encoder.writerows([(None, "a", None), (1, "b", None)])
+    field_encoders = encoder.encoders
+    assert field_encoders[0] is not encoders.encode_field
+    assert field_encoders[1] is encoders.encode_field
+    assert field_encoders[2] is encoders.encode_field
+    # the types are only detected from the first batch
+    encoder.writerows([("x", 2, 3)])
+    assert encoder.encoders is field_encoders
+
+
+def test_profiling_encoder(caplog):
+    output = StringIO()
+    encoder = encoders.ProfilingEncoder(encoders.CsvRowEncoder(output))
+    encoder.writerow(("a", "b"))
+    encoder.writerows([(1, 2)])
+    with caplog.at_level(logging.INFO, logger="django_csv.encoders"):
+        encoder.close()
+    assert output.getvalue() == "a,b\r\n1,2\r\n"
+    assert "CSV export profile:" in caplog.text
+    assert "writerows" in caplog.text
+
+
+def test_profiling_encoder__profile_dir(tmp_path):
+    encoder = encoders.ProfilingEncoder(encoders.FastRowEncoder(StringIO()))
+    encoder.writerows([(1, 2)])
+    with override_settings(CSV_DOWNLOAD_PROFILE_DIR=str(tmp_path)):
+        filename = encoder.dump_stats()
+    assert filename.startswith(str(tmp_path))
+    assert [p.name for p in tmp_path.iterdir()] == [filename.split("/")[-1]]
+
+
+def test_writer__encoder_klass():
+    writer = csv.BulkQuerySetWriter(StringIO(), User.objects.none())
+    assert isinstance(writer.writer, encoders.CsvRowEncoder)
+    writer = csv.BulkQuerySetWriter(
+        StringIO(), User.objects.none(), encoder_klass=encoders.FastRowEncoder
+    )
+    assert isinstance(writer.writer, encoders.FastRowEncoder)
+    with override_settings(
+        CSV_DOWNLOAD_ENCODER="django_csv.encoders.FastRowEncoder",
+        CSV_DOWNLOAD_PROFILE=True,
+    ):
+        writer = csv.BulkQuerySetWriter(StringIO(), User.objects.none())
+        assert isinstance(writer.writer, encoders.ProfilingEncoder)
+        assert isinstance(writer.writer.encoder, encoders.FastRowEncoder)
+        writer = csv.BulkQuerySetWriter(StringIO(), User.objects.none(), profile=False)
+        assert isinstance(writer.writer, encoders.FastRowEncoder)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "klass",
+    (csv.BulkQuerySetWriter, csv.KeysetQuerySetWriter, csv.RowQuerySetWriter),
+)
+def test_write_csv__fast_encoder(klass, caplog):
+    User.objects.create_user("user1", first_name="Jo, Jr", is_staff=True)
+    User.objects.create_user("user2", last_name='"Bob"')
+    columns = ("username", "first_name", "last_name", "is_staff", "date_joined")
+    expected = StringIO()
+    csv.write_csv(expected, User.objects.order_by("pk"), *columns, writer_klass=klass)
+    output = StringIO()
+    with caplog.at_level(logging.INFO, logger="django_csv.encoders"):
+        row_count = csv.write_csv(
+            output,
+            User.objects.order_by("pk"),
+            *columns,
+            writer_klass=klass,
+            encoder_klass=encoders.FastRowEncoder,
+            profile=True,
+        )
+    assert row_count == 2
+    assert output.getvalue() == expected.getvalue()
+    # the profile stats are dumped when the writer is closed
+    assert "CSV export profile:" in caplog.text
@@ -0,0 +1,80 @@
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import User
+
+from django_csv import estimate
+
+
+@pytest.fixture
+def users():
+    return [User.objects.create_user(f"user{i}") for i in range(5)]
+
+
+@pytest.mark.django_db
+class TestEstimateRows:
+    def test_exact(self, users):
+        assert estimate.estimate_rows(User.objects.all()) == (5, True)
+
+    @pytest.mark.parametrize("limit,rows", ((10, 5), (5, 5), (3, 4)))
+    def test_bounded(self, users, limit, rows):
+        assert estimate.estimate_rows(User.objects.all(), limit=limit) == (rows, True)
+
+    @pytest.mark.parametrize(
+        "plan", ([{"Plan": {"Plan Rows": 12345}}], '[{"Plan": {"Plan Rows": 12345}}]')
+    )
+    def test_postgresql(self, plan):
+        connection = mock.MagicMock(vendor="postgresql")
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (plan,)
+        with mock.patch.object(estimate, "connections", {"default": connection}):
+            rows = estimate.estimate_rows(User.objects.all(), limit=10)
+        assert rows == (12345, False)
+        assert cursor.execute.call_args[0][0].startswith("EXPLAIN (FORMAT JSON) SELECT")
+
+    def test_postgresql__using(self):
+        """Check the EXPLAIN is compiled for the queryset's database alias."""
+        connection = mock.MagicMock(vendor="postgresql")
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = ([{"Plan": {"Plan Rows": 1}}],)
+        queryset = User.objects.using("replica")
+        with mock.patch.object(
+            estimate, "connections", {"replica": connection}
+        ), mock.patch.object(type(queryset.query), "get_compiler") as mock_compiler:
+            mock_compiler.return_value.as_sql.return_value = ("SELECT 1", ())
+            assert estimate.estimate_rows(queryset, limit=10) == (1, False)
+        mock_compiler.assert_called_once_with(using="replica")
+        cursor.execute.assert_called_once_with("EXPLAIN (FORMAT JSON) SELECT 1", ())
+
+    @pytest.mark.parametrize(
+        "queryset", (User.objects.none(), User.objects.filter(pk__in=[]))
+    )
+    def test_postgresql__empty(self, queryset):
+        connection = mock.MagicMock(vendor="postgresql")
+        with mock.patch.object(estimate, "connections", {"default": connection}):
+            assert estimate.estimate_rows(queryset, limit=10) == (0, True)
+        assert connection.cursor.call_count == 0
+
+
+@pytest.mark.django_db
+def test_estimate_row_width(users):
+    # "userN\r\n"
+    width = estimate.estimate_row_width(User.objects.all(), "username")
+    assert width == 7
+
+
+@pytest.mark.django_db
+def test_estimate_row_width__empty():
+    assert estimate.estimate_row_width(User.objects.all(), "username") == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "max_rows,rows,size,truncated", ((10, 5, 35, False), (2, 3, 14, True))
+)
+def test_estimate_export(users, max_rows, rows, size, truncated):
+    result = estimate.estimate_export(User.objects.all(), "username", max_rows=max_rows)
+    assert result.rows == rows
+    assert result.bytes == size
+    assert result.exact
+    assert result.truncated == truncated
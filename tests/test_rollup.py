@@ -0,0 +1,145 @@
+import datetime
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+
+from django_csv import rollup
+from django_csv.models import (
+    CsvDownload,
+    CsvDownloadRollup,
+    CsvDownloadRollupWatermark,
+    CsvExportCheckpoint,
+)
+
+DAY1 = datetime.date(2024, 1, 1)
+DAY2 = datetime.date(2024, 1, 2)
+
+
+def _download(user, filename, day, row_count=10, byte_count=100):
+    download = CsvDownload.objects.create(
+        user=user, filename=filename, row_count=row_count, byte_count=byte_count
+    )
+    # timestamp is auto_now_add, so can only be backdated with an update
+    timestamp = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+    CsvDownload.objects.filter(pk=download.pk).update(timestamp=timestamp)
+    return download
+
+
+def _rollups():
+    return {
+        (r.date, r.user_id, r.filename): (r.download_count, r.row_count, r.byte_count)
+        for r in CsvDownloadRollup.objects.all()
+    }
+
+
+@pytest.mark.django_db
+class TestRollupDownloads:
+    def test_rollup(self, django_assert_max_num_queries):
+        user = User.objects.create_user("user")
+        _download(user, "users.csv", DAY1)
+        _download(user, "users.csv", DAY1, row_count=5, byte_count=None)
+        _download(user, "users.csv", DAY2)
+        last = _download(None, "feed.csv", DAY1, row_count=None)
+        # a constant number of queries per batch (plus savepoints), however many
+        # downloads are in it
+        with django_assert_max_num_queries(17):
+            assert rollup.rollup_downloads() == 4
+        assert _rollups() == {
+            (DAY1, user.pk, "users.csv"): (2, 15, 100),
+            (DAY2, user.pk, "users.csv"): (1, 10, 100),
+            (DAY1, None, "feed.csv"): (1, 0, 100),
+        }
+        assert CsvDownloadRollupWatermark.objects.get().last_download_id == last.pk
+
+    def test_rollup__incremental(self):
+        user = User.objects.create_user("user")
+        _download(user, "users.csv", DAY1)
+        assert rollup.rollup_downloads() == 1
+        assert rollup.rollup_downloads() == 0
+        _download(user, "users.csv", DAY1)
+        _download(user, "users.csv", DAY2)
+        # batches are merged into the existing rollups
+        assert rollup.rollup_downloads(batch_size=1) == 2
+        assert _rollups() == {
+            (DAY1, user.pk, "users.csv"): (2, 20, 200),
+            (DAY2, user.pk, "users.csv"): (1, 10, 100),
+        }
+
+    def test_rollup__settle_time(self):
+        CsvDownload.objects.create(filename="new.csv")
+        assert rollup.rollup_downloads() == 0
+        assert rollup.rollup_downloads(settle_time=-60) == 1
+
+    def test_rollup__pending_export(self):
+        """Check that the watermark is held below a resumable export in progress."""
+        user = User.objects.create_user("user")
+        _download(user, "users.csv", DAY1)
+        # resumable exports record the download (without counts) when they start
+        download = _download(user, "export.csv", DAY1, row_count=None, byte_count=None)
+        checkpoint = CsvExportCheckpoint.objects.create(
+            download=download, destination="s3://bucket/export.csv", row_count=5
+        )
+        last = _download(user, "users.csv", DAY1)
+        assert rollup.rollup_downloads() == 1
+        assert _rollups() == {(DAY1, user.pk, "users.csv"): (1, 10, 100)}
+        # once the export completes its counts (and later downloads) are rolled up
+        CsvDownload.objects.filter(pk=download.pk).update(row_count=5, byte_count=50)
+        checkpoint.completed_at = timezone.now()
+        checkpoint.save()
+        assert rollup.rollup_downloads() == 2
+        assert _rollups() == {
+            (DAY1, user.pk, "users.csv"): (2, 20, 200),
+            (DAY1, user.pk, "export.csv"): (1, 5, 50),
+        }
+        assert CsvDownloadRollupWatermark.objects.get().last_download_id == last.pk
+
+    def test_rollup__abandoned_export(self):
+        download = _download(None, "export.csv", DAY1, row_count=None)
+        CsvExportCheckpoint.objects.create(download=download, destination="s3://b/k")
+        assert rollup.rollup_downloads() == 0
+        assert rollup.rollup_downloads(pending_timeout=-60) == 1
+
+    def test_command(self, capsys):
+        _download(None, "feed.csv", DAY1)
+        call_command("rollup_csv_downloads", "--batch-size", "5")
+        assert capsys.readouterr().out == "Rolled up 1 downloads.\n"
+        assert CsvDownloadRollup.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_usage_summary():
+    user1 = User.objects.create_user("user1")
+    user2 = User.objects.create_user("user2")
+    _download(user1, "small.csv", DAY1, row_count=1, byte_count=10)
+    _download(user1, "small.csv", DAY2, row_count=1, byte_count=10)
+    _download(user2, "large.csv", DAY2, row_count=100, byte_count=1000)
+    _download(user2, "large.csv", DAY2 + datetime.timedelta(days=1))
+    rollup.rollup_downloads()
+    summary = rollup.usage_summary(rollup.rollups_between(DAY1, DAY2), limit=1)
+    assert summary.totals == {"downloads": 3, "rows": 102, "bytes": 1020}
+    assert summary.daily == [
+        {"date": DAY1, "downloads": 1, "rows": 1, "bytes": 10},
+        {"date": DAY2, "downloads": 2, "rows": 101, "bytes": 1010},
+    ]
+    assert summary.top_users == [
+        {
+            "user": user2.pk,
+            "username": "user2",
+            "downloads": 1,
+            "rows": 100,
+            "bytes": 1000,
+        }
+    ]
+    assert summary.top_filenames == [
+        {"filename": "large.csv", "downloads": 1, "rows": 100, "bytes": 1000}
+    ]
+
+
+@pytest.mark.django_db
+def test_usage_summary__empty():
+    summary = rollup.usage_summary(rollup.rollups_between(DAY1, DAY2))
+    assert summary == rollup.UsageSummary(
+        {"downloads": 0, "rows": 0, "bytes": 0}, [], [], []
+    )
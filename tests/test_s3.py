@@ -1,10 +1,13 @@
-from io import BufferedIOBase
+import hashlib
+from io import BufferedIOBase, BytesIO
 from unittest import mock
 
 import pytest
 from django.contrib.auth.models import User
 
 from django_csv import csv, s3
+from django_csv.checksum import Checksum
+from django_csv.models import CsvDownload
 
 
 @pytest.mark.django_db
@@ -37,6 +40,63 @@ def test_s3_upload(mock_upload):
     assert isinstance(call_args[2], BufferedIOBase)
 
 
+@pytest.mark.django_db
+@mock.patch("django_csv.s3._put_object")
+def test_s3_upload__checksum(mock_upload):
+    User.objects.create_user("user1")
+    with s3.s3_upload("bucket_name", "filename") as fileobj:
+        csv.write_csv(fileobj, User.objects.all(), "username")
+    data = b"username\r\nuser1\r\n"
+    checksum = mock_upload.call_args.kwargs["checksum"]
+    assert checksum.sha256 == hashlib.sha256(data).hexdigest()
+    assert checksum.size == len(data)
+
+
+@mock.patch("django_csv.s3.get_client")
+def test_put_object__checksum(mock_client):
+    checksum = Checksum()
+    checksum.update(b"data")
+    s3._put_object("bucket", "key", BytesIO(b"data"), checksum=checksum)
+    kwargs = mock_client.return_value.put_object.call_args.kwargs
+    assert kwargs["ContentMD5"] == checksum.content_md5
+    assert kwargs["ChecksumSHA256"] == checksum.checksum_sha256
+
+
+@mock.patch("django_csv.s3.get_client")
+def test_upload_fileobj__checksum(mock_client):
+    checksum = Checksum()
+    checksum.update(b"data")
+    s3._upload_fileobj("bucket", "key", BytesIO(b"data"), checksum=checksum)
+    extra_args = mock_client.return_value.upload_fileobj.call_args.kwargs["ExtraArgs"]
+    assert extra_args["ChecksumAlgorithm"] == "SHA256"
+    assert extra_args["Metadata"] == {"md5": checksum.md5, "sha256": checksum.sha256}
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("multipart", (True, False))
+def test_write_csv_s3__record(multipart):
+    user = User.objects.create_user("user1")
+    with mock.patch("django_csv.s3._put_object"), mock.patch(
+        "django_csv.s3._upload_fileobj"
+    ):
+        row_count = s3.write_csv_s3(
+            "bucket/path/users.csv",
+            User.objects.all(),
+            "username",
+            multipart=multipart,
+            record=True,
+            user=user,
+        )
+    data = b"username\r\nuser1\r\n"
+    download = CsvDownload.objects.get()
+    assert download.user == user
+    assert download.filename == "users.csv"
+    assert download.row_count == row_count == 1
+    assert download.byte_count == len(data)
+    assert download.sha256 == hashlib.sha256(data).hexdigest()
+    assert download.md5 == hashlib.md5(data).hexdigest()  # noqa: S324
+
+
 @pytest.mark.parametrize(
     "url,bucket,key",
     [
@@ -54,3 +114,9 @@ def test_parse_url(url, bucket, key):
 def test_parse_url__error(url):
     with pytest.raises(ValueError):
         s3.parse_url(url)
+
+
+def test_import_boto3__missing():
+    with mock.patch.dict("sys.modules", {"boto3": None}):
+        with pytest.raises(ImportError):
+            s3._import_boto3()
@@ -0,0 +1,116 @@
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.urls import reverse
+
+from django_csv import serve
+from django_csv.models import CsvDownload
+from django_csv.storage import write_csv_storage
+from django_csv.views import StoredCsvDownloadView
+
+CONTENT = b"username\r\nuser1\r\nuser2\r\n"
+
+
+@pytest.mark.parametrize(
+    "header,byte_range",
+    (
+        ("bytes=0-9", (0, 9)),
+        ("bytes=10-", (10, 23)),
+        ("bytes=10-100", (10, 23)),
+        ("bytes=-5", (19, 23)),
+        ("bytes=-100", (0, 23)),
+        ("bytes=5-1", None),
+        ("bytes=0-1,5-6", None),
+        ("bytes=-", None),
+        ("items=0-1", None),
+    ),
+)
+def test_parse_range(header, byte_range):
+    assert serve.parse_range(header, 24) == byte_range
+
+
+@pytest.mark.parametrize("header", ("bytes=24-", "bytes=100-200", "bytes=-0"))
+def test_parse_range__unsatisfiable(header):
+    with pytest.raises(ValueError):
+        serve.parse_range(header, 24)
+
+
+@pytest.mark.django_db
+class TestStoredCsvDownloadView:
+    @pytest.fixture
+    def user(self, client):
+        user = User.objects.create_user("user1")
+        User.objects.create_user("user2")
+        client.force_login(user)
+        return user
+
+    @pytest.fixture
+    def download(self, user, tmp_path):
+        storage = FileSystemStorage(location=tmp_path)
+        with mock.patch.object(StoredCsvDownloadView, "get_storage", lambda s: storage):
+            yield write_csv_storage(
+                storage, "users.csv", User.objects.order_by("id"), "username", user=user
+            )
+
+    @pytest.fixture
+    def url(self, download):
+        return reverse("stored_download", kwargs={"pk": download.pk})
+
+    def test_get(self, client, download, url):
+        response = client.get(url)
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == CONTENT
+        assert response["Content-Length"] == str(len(CONTENT))
+        assert response["Content-Type"] == "text/csv"
+        assert response["Accept-Ranges"] == "bytes"
+        assert response["ETag"]
+        assert response["Content-Disposition"] == 'attachment; filename="users.csv"'
+        # recorded as a re-download, not recomputed
+        redownload = download.redownloads.get()
+        assert redownload.row_count == 2
+        assert redownload.byte_count == len(CONTENT)
+        assert redownload.storage_name == "users.csv"
+
+    def test_get__range(self, client, download, url):
+        response = client.get(url, HTTP_RANGE="bytes=10-")
+        assert response.status_code == 206
+        assert b"".join(response.streaming_content) == CONTENT[10:]
+        assert response["Content-Range"] == "bytes 10-23/24"
+        assert response["Content-Length"] == "14"
+        # resuming a download is not a new download
+        assert not download.redownloads.exists()
+
+    def test_get__range_from_start(self, client, download, url):
+        response = client.get(url, HTTP_RANGE="bytes=0-9")
+        assert response.status_code == 206
+        assert b"".join(response.streaming_content) == CONTENT[:10]
+        assert download.redownloads.count() == 1
+
+    def test_get__unsatisfiable(self, client, url):
+        response = client.get(url, HTTP_RANGE="bytes=100-")
+        assert response.status_code == 416
+        assert response["Content-Range"] == "bytes */24"
+
+    def test_get__if_range(self, client, url):
+        etag = client.get(url)["ETag"]
+        response = client.get(url, HTTP_RANGE="bytes=10-", HTTP_IF_RANGE=etag)
+        assert response.status_code == 206
+        response = client.get(url, HTTP_RANGE="bytes=10-", HTTP_IF_RANGE='"stale"')
+        assert response.status_code == 200
+        assert b"".join(response.streaming_content) == CONTENT
+
+    def test_get__if_none_match(self, client, url):
+        etag = client.get(url)["ETag"]
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+
+    def test_get__permission_denied(self, client, url):
+        client.force_login(User.objects.get(username="user2"))
+        assert client.get(url).status_code == 403
+
+    def test_get__not_stored(self, client, user):
+        download = CsvDownload.objects.create(user=user, filename="users.csv")
+        url = reverse("stored_download", kwargs={"pk": download.pk})
+        assert client.get(url).status_code == 404
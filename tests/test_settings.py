@@ -0,0 +1,31 @@
+import pytest
+from django.test import override_settings
+
+from django_csv import settings as app_settings
+
+
+def test_settings__default():
+    assert app_settings.DEFAULT_BATCH_SIZE == 2000
+
+
+def test_settings__override():
+    assert app_settings.RETRY_AFTER == 30
+    with override_settings(CSV_DOWNLOAD_RETRY_AFTER=60):
+        assert app_settings.RETRY_AFTER == 60
+    assert app_settings.RETRY_AFTER == 30
+
+
+def test_settings__cached():
+    assert app_settings.MAX_ROWS == 10000
+    app_settings._cache["MAX_ROWS"] = 1
+    assert app_settings.MAX_ROWS == 1
+    # only changes to CSV_DOWNLOAD_* settings clear the cache
+    app_settings.clear_cache(setting="OTHER_SETTING")
+    assert app_settings.MAX_ROWS == 1
+    app_settings.clear_cache(setting="CSV_DOWNLOAD_MAX_ROWS")
+    assert app_settings.MAX_ROWS == 10000
+
+
+def test_settings__unknown():
+    with pytest.raises(AttributeError):
+        app_settings.UNKNOWN_SETTING  # noqa: B018
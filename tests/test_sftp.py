@@ -1,6 +1,53 @@
+import hashlib
+from unittest import mock
+
 import pytest
+from django.contrib.auth.models import User
+
+from django_csv import csv, sftp
+from django_csv.models import CsvDownload
+
+DATA = b"username\r\nuser1\r\n"
+
 
-from django_csv import sftp
+@pytest.mark.django_db
+@pytest.mark.parametrize("sidecar", (True, False))
+def test_sftp_upload__sidecar(sidecar):
+    User.objects.create_user("user1")
+    client = mock.Mock()
+    uploads = {}
+    client.putfo.side_effect = lambda fileobj, path: uploads.update(
+        {path: fileobj.read()}
+    )
+    with sftp.sftp_upload(client, "path/to/users.csv", sidecar=sidecar) as fileobj:
+        csv.write_csv(fileobj, User.objects.all(), "username")
+    assert uploads.pop("path/to/users.csv") == DATA
+    if sidecar:
+        sha256 = hashlib.sha256(DATA).hexdigest()
+        assert uploads == {
+            "path/to/users.csv.sha256": f"{sha256}  users.csv\n".encode()
+        }
+    else:
+        assert uploads == {}
+
+
+@pytest.mark.django_db
+@mock.patch("django_csv.sftp.sftp_client")
+def test_write_csv_sftp__record(mock_client):
+    user = User.objects.create_user("user1")
+    row_count = sftp.write_csv_sftp(
+        "username:password@hostname:22/path/users.csv",
+        User.objects.all(),
+        "username",
+        record=True,
+        user=user,
+    )
+    download = CsvDownload.objects.get()
+    assert download.user == user
+    assert download.filename == "users.csv"
+    assert download.row_count == row_count == 1
+    assert download.byte_count == len(DATA)
+    assert download.sha256 == hashlib.sha256(DATA).hexdigest()
 
 
 @pytest.mark.parametrize(
@@ -45,3 +92,10 @@ def test_parse_url(url, scheme, username, password, hostname, port, path):
 def test_parse_url__error(url):
     with pytest.raises(ValueError):
         sftp.parse_url(url)
+
+
+def test_sftp_client__no_paramiko():
+    with mock.patch.dict("sys.modules", {"paramiko": None}):
+        with pytest.raises(ImportError):
+            with sftp.sftp_client("hostname", "username", password="password"):
+                pass
@@ -0,0 +1,242 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import FileSystemStorage
+from django.db import connections
+from django.db.models import Count
+from django.test import override_settings
+
+from django_csv import singleflight
+from django_csv.columns import AnnotationColumn, BatchColumn
+from django_csv.models import CsvDownload
+
+
+class LaggingReplicaRouter:
+    """Read CsvDownloads from a replica that never catches up."""
+
+    def db_for_read(self, model, **hints):
+        return "replica" if model is CsvDownload else None
+
+
+@pytest.mark.django_db
+class TestExportKey:
+    def test_same_export(self):
+        key = singleflight.export_key(User.objects.all(), "username", max_rows=10)
+        assert key == singleflight.export_key(
+            User.objects.all(), "username", max_rows=10
+        )
+
+    @pytest.mark.parametrize(
+        "queryset,columns,spec",
+        (
+            (User.objects.filter(is_staff=True), ("username",), {"max_rows": 10}),
+            (User.objects.using("replica"), ("username",), {"max_rows": 10}),
+            (User.objects.all(), ("username", "email"), {"max_rows": 10}),
+            (User.objects.all(), ("username",), {"max_rows": 20}),
+            (
+                User.objects.all(),
+                ("username", AnnotationColumn("group_count", Count("groups"))),
+                {"max_rows": 10},
+            ),
+            (
+                User.objects.all(),
+                ("username", BatchColumn("extra", dict, default=0)),
+                {"max_rows": 10},
+            ),
+        ),
+    )
+    def test_different_export(self, queryset, columns, spec):
+        key = singleflight.export_key(User.objects.all(), "username", max_rows=10)
+        assert key != singleflight.export_key(queryset, *columns, **spec)
+
+    def test_using(self):
+        """Check the query is compiled for the queryset's database alias."""
+        queryset = User.objects.using("replica")
+        with mock.patch.object(
+            type(queryset.query), "get_compiler", autospec=True
+        ) as mock_compiler:
+            mock_compiler.return_value.as_sql.return_value = ("SELECT 1", ())
+            singleflight.export_key(queryset, "username")
+        assert mock_compiler.call_args.kwargs == {"using": "replica"}
+
+    def test_empty_queryset(self):
+        key = singleflight.export_key(User.objects.none(), "username")
+        assert key != singleflight.export_key(User.objects.all(), "username")
+
+
+class TestSingleFlight:
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        cache.clear()
+
+    def _run_together(self, flights, func, count=4):
+        """Run func on each flight (in threads), while func is blocked."""
+        with ThreadPoolExecutor(max_workers=count) as pool:
+            futures = [
+                pool.submit(flights[i % len(flights)].run, "key", func)
+                for i in range(count)
+            ]
+            return [f.result(timeout=5) for f in futures]
+
+    def _blocking(self):
+        calls = []
+        started = threading.Event()
+
+        def _func():
+            calls.append(1)
+            started.wait(0.2)
+            return len(calls)
+
+        return calls, _func
+
+    def test_run__local(self):
+        calls, func = self._blocking()
+        results = self._run_together([singleflight.SingleFlight()], func)
+        assert len(calls) == 1
+        assert sorted(results) == [(1, False), (1, False), (1, False), (1, True)]
+
+    def test_run__shared(self):
+        """Check that flights in different "processes" share via the cache."""
+        calls, func = self._blocking()
+        flights = [singleflight.SingleFlight(), singleflight.SingleFlight()]
+        for flight in flights:
+            flight.poll_interval = 0.01
+        results = self._run_together(flights, func)
+        assert len(calls) == 1
+        assert [ran for _, ran in results].count(True) == 1
+        assert cache.get("django_csv:singleflight:key") is None
+
+    def test_run__sequential(self):
+        flight = singleflight.SingleFlight()
+        assert flight.run("key", lambda: 1) == (1, True)
+        assert flight.run("key", lambda: 2) == (2, True)
+
+    def test_run__error(self):
+        flight = singleflight.SingleFlight()
+
+        def _func():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            flight.run("key", _func)
+        assert not flight.flights
+        assert cache.get("django_csv:singleflight:key") is None
+
+    def test_run__leader_gone(self):
+        """Check that a follower runs func if the leader has no result."""
+        flight = singleflight.SingleFlight()
+        flight.poll_interval = 0.01
+        cache.set("django_csv:singleflight:key", "token")
+        threading.Timer(0.05, cache.delete, ["django_csv:singleflight:key"]).start()
+        assert flight.run("key", lambda: 1) == (1, True)
+
+    def test_run__timeout(self):
+        flight = singleflight.SingleFlight()
+        flight.poll_interval = 0.01
+        flight.wait_timeout = 0.05
+        cache.set("django_csv:singleflight:key", "token")
+        assert flight.run("key", lambda: 1) == (1, True)
+
+
+@pytest.mark.django_db
+class TestDownloadCsvCoalesced:
+    @pytest.fixture
+    def storage(self, tmp_path):
+        return FileSystemStorage(location=tmp_path)
+
+    def test_download(self, storage):
+        user = User.objects.create_user("user1")
+        response = singleflight.download_csv_coalesced(
+            user, "users.csv", User.objects.all(), "username", storage=storage
+        )
+        assert b"".join(response.streaming_content) == b"username\r\nuser1\r\n"
+        assert response["Content-Disposition"] == 'attachment; filename="users.csv"'
+        assert response["X-Row-Count"] == "1"
+        download = CsvDownload.objects.get()
+        assert download.user == user
+        assert download.filename == "users.csv"
+        assert download.storage_name.startswith("csv-exports/")
+        assert download.source is None
+
+    def test_download__coalesced(self, storage):
+        """Check that a follower is served the leader's export, and recorded."""
+        leader = User.objects.create_user("user1")
+        response = singleflight.download_csv_coalesced(
+            leader, "users.csv", User.objects.all(), "username", storage=storage
+        )
+        follower = User.objects.create_user("user2")
+        source = CsvDownload.objects.get()
+        result = {f: getattr(source, f) for f in singleflight.SHARED_FIELDS}
+        with mock.patch.object(
+            singleflight.single_flight, "run", return_value=(result, False)
+        ) as mock_run:
+            response = singleflight.download_csv_coalesced(
+                follower, "users.csv", User.objects.all(), "username", storage=storage
+            )
+        # the follower gets the leader's bytes (without user2)
+        assert b"".join(response.streaming_content) == b"username\r\nuser1\r\n"
+        assert mock_run.call_args.args[0] == singleflight.export_key(
+            User.objects.all(),
+            "username",
+            filename="users.csv",
+            header=True,
+            max_rows=10000,
+            column_headers=None,
+            writer_klass=singleflight.BulkQuerySetWriter,
+            using=None,
+            statement_timeout=None,
+        )
+        download = CsvDownload.objects.latest("pk")
+        assert download.user == follower
+        assert download.source == source
+        assert download.byte_count == source.byte_count
+        assert download.sha256 == source.sha256
+        assert CsvDownload.objects.count() == 2
+
+    @pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+    @override_settings(DATABASE_ROUTERS=[LaggingReplicaRouter()])
+    def test_download__follower_thread(self, storage):
+        """Check that a follower doesn't read the leader's (unseen) download."""
+        leader = User.objects.create_user("user1")
+        follower = User.objects.create_user("user2")
+        exporting, follower_waiting = threading.Event(), threading.Event()
+        write_csv_storage = singleflight.write_csv_storage
+        wait = singleflight.Flight.wait
+
+        def _write(*args, **kwargs):
+            # hold the export until the follower has joined the flight
+            exporting.set()
+            assert follower_waiting.wait(timeout=5)
+            return write_csv_storage(*args, **kwargs)
+
+        def _wait(flight):
+            follower_waiting.set()
+            return wait(flight)
+
+        def _download(user):
+            try:
+                response = singleflight.download_csv_coalesced(
+                    user, "users.csv", User.objects.all(), "username", storage=storage
+                )
+                return b"".join(response.streaming_content)
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(
+            singleflight, "write_csv_storage", _write
+        ), mock.patch.object(singleflight.Flight, "wait", _wait):
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                leading = pool.submit(_download, leader)
+                assert exporting.wait(timeout=5)
+                following = pool.submit(_download, follower)
+                contents = [leading.result(timeout=5), following.result(timeout=5)]
+        assert contents == [b"username\r\nuser1\r\nuser2\r\n"] * 2
+        source, download = CsvDownload.objects.using("default").order_by("pk")
+        assert source.user == leader
+        assert download.user == follower
+        assert download.source_id == source.pk
+        assert download.sha256 == source.sha256
@@ -0,0 +1,47 @@
+"""Startup time checks - run in a fresh interpreter, as imports are cached."""
+
+import os
+import subprocess
+import sys
+
+SCRIPT = """
+import sys
+import django
+django.setup()
+import django_csv.s3, django_csv.sftp, django_csv.views
+print(",".join(m for m in ("boto3", "paramiko") if m in sys.modules))
+"""
+
+
+def _run(*args):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="tests.settings")
+    return subprocess.run(  # noqa: S603
+        [sys.executable, *args, "-c", SCRIPT],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def _import_times(stderr):
+    """Parse `-X importtime` output into {module: cumulative microseconds}."""
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_optional_backends_not_imported():
+    assert _run().stdout.strip() == ""
+
+
+def test_import_time():
+    times = _import_times(_run("-X", "importtime").stderr)
+    # without boto3 / paramiko each module imports in a few ms - the budget is
+    # generous so that this only fails if a heavy dependency creeps back in
+    for module in ("django_csv.s3", "django_csv.sftp"):
+        assert times[module] < 50_000, f"{module} took {times[module]}us to import"
@@ -0,0 +1,83 @@
+import hashlib
+
+import pytest
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldError
+from django.core.files.storage import FileSystemStorage
+
+from django_csv import storage
+
+try:
+    from django.core.files.storage import InMemoryStorage
+except ImportError:  # Django < 4.2
+    InMemoryStorage = None
+
+
+@pytest.fixture
+def users():
+    User.objects.create_user("user1")
+    User.objects.create_user("user2")
+
+
+@pytest.mark.django_db
+class TestWriteCsvStorage:
+    def test_filesystem(self, users, tmp_path):
+        fs = FileSystemStorage(location=tmp_path)
+        download = storage.write_csv_storage(
+            fs,
+            "exports/users.csv",
+            User.objects.order_by("id"),
+            "username",
+            chunk_size=4,
+        )
+        assert fs.open("exports/users.csv").read() == b"username\r\nuser1\r\nuser2\r\n"
+        assert download.filename == "users.csv"
+        assert download.row_count == 2
+        assert download.byte_count == 24
+        assert (
+            download.sha256
+            == hashlib.sha256(fs.open("exports/users.csv").read()).hexdigest()
+        )
+        assert download.columns == "username"
+        # no temporary files left behind
+        assert fs.listdir("exports") == ([], ["users.csv"])
+
+    def test_filesystem__replaces(self, users, tmp_path):
+        fs = FileSystemStorage(location=tmp_path)
+        fs.save("users.csv", open(__file__, "rb"))
+        storage.write_csv_storage(
+            fs, "users.csv", User.objects.order_by("id"), "username"
+        )
+        assert fs.listdir("") == ([], ["users.csv"])
+        assert fs.open("users.csv").read() == b"username\r\nuser1\r\nuser2\r\n"
+
+    def test_filesystem__error(self, users, tmp_path):
+        fs = FileSystemStorage(location=tmp_path)
+        with pytest.raises(FieldError):
+            storage.write_csv_storage(fs, "users.csv", User.objects.all(), "nope")
+        assert fs.listdir("") == ([], [])
+
+    @pytest.mark.skipif(InMemoryStorage is None, reason="Requires Django 4.2+")
+    def test_in_memory(self, users):
+        memory = InMemoryStorage()
+        download = storage.write_csv_storage(
+            memory, "users.csv", User.objects.order_by("id"), "username", header=False
+        )
+        assert memory.open("users.csv").read() == b"user1\r\nuser2\r\n"
+        assert download.row_count == 2
+        assert download.byte_count == 14
+
+
+def test_generator_stream():
+    def _generate():
+        yield b"abc"
+        yield b""
+        yield b"defg"
+        return 42
+
+    stream = storage.GeneratorStream(_generate())
+    assert stream.read(2) == b"ab"
+    assert stream.read() == b"cdefg"
+    assert stream.read() == b""
+    assert stream.result == 42
+    assert stream.size == 7
@@ -0,0 +1,57 @@
+from io import BytesIO
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import User
+
+from django_csv import tee
+
+
+class BrokenFile:
+    def write(self, data):
+        raise OSError("Connection lost")
+
+
+@pytest.mark.django_db
+def test_write_csv_tee():
+    User.objects.create_user("user1")
+    User.objects.create_user("user2")
+    fileobjs = [BytesIO(), BytesIO(), BytesIO()]
+    qs = User.objects.order_by("id")
+    with mock.patch.object(qs, "values_list", wraps=qs.values_list) as values_list:
+        row_count = tee.write_csv_tee(fileobjs, qs, "username", block_size=1)
+    # one pass over the queryset, regardless of the number of destinations
+    assert values_list.call_count == 1
+    assert row_count == 2
+    for fileobj in fileobjs:
+        assert fileobj.getvalue() == b"username\r\nuser1\r\nuser2\r\n"
+
+
+@pytest.mark.django_db
+def test_write_csv_tee__fail_fast():
+    User.objects.create_user("user1")
+    fileobjs = [BytesIO(), BrokenFile()]
+    with pytest.raises(tee.TeeError) as ex:
+        tee.write_csv_tee(fileobjs, User.objects.all(), "username")
+    assert list(ex.value.errors) == [1]
+    assert isinstance(ex.value.errors[1], OSError)
+
+
+@pytest.mark.django_db
+def test_write_csv_tee__no_fail_fast():
+    for i in range(100):
+        User.objects.create_user(f"user{i}")
+    fileobjs = [BytesIO(), BrokenFile(), BytesIO()]
+    with pytest.raises(tee.TeeError) as ex:
+        tee.write_csv_tee(
+            fileobjs,
+            User.objects.all(),
+            "username",
+            fail_fast=False,
+            block_size=16,
+            queue_size=1,
+        )
+    assert list(ex.value.errors) == [1]
+    assert ex.value.row_count == 100
+    assert fileobjs[0].getvalue() == fileobjs[2].getvalue()
+    assert len(fileobjs[0].getvalue().splitlines()) == 101
@@ -0,0 +1,196 @@
+import functools
+import threading
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+
+from django_csv import throttle
+from django_csv.models import CsvDownload
+
+
+@pytest.fixture(
+    params=[throttle.LocalConcurrencyBackend, throttle.CacheConcurrencyBackend]
+)
+def backend(request):
+    cache.clear()
+    return request.param()
+
+
+class TestConcurrencyBackend:
+    def test_acquire_release(self, backend):
+        assert backend.acquire("key", 2, timeout=0)
+        assert backend.acquire("key", 2, timeout=0)
+        assert not backend.acquire("key", 2, timeout=0)
+        # other keys are independent
+        assert backend.acquire("other", 2, timeout=0)
+        backend.release("key")
+        assert backend.acquire("key", 2, timeout=0)
+
+    def test_acquire__wait(self, backend):
+        assert backend.acquire("key", 1, timeout=0)
+        timer = threading.Timer(0.05, backend.release, args=("key",))
+        timer.start()
+        assert backend.acquire("key", 1, timeout=5)
+        timer.join()
+
+
+class TestCacheConcurrencyBackend:
+    @pytest.fixture
+    def backend(self):
+        cache.clear()
+        return throttle.CacheConcurrencyBackend()
+
+    def test_acquire__refreshes_ttl(self, backend):
+        with mock.patch.object(cache, "touch", wraps=cache.touch) as mock_touch:
+            assert backend.acquire("key", 2, timeout=0)
+        mock_touch.assert_called_once_with("django_csv:slots:key", backend.slot_ttl)
+
+    def test_release__after_reset(self, backend):
+        """Check that a counter reset while slots are held stays >= 0."""
+        assert backend.acquire("key", 1, timeout=0)
+        assert backend.acquire("other", 1, timeout=0)
+        # the counter expires, and is recreated by a new export
+        cache.delete("django_csv:slots:key")
+        assert backend.acquire("key", 1, timeout=0)
+        backend.release("key")
+        backend.release("key")
+        assert cache.get("django_csv:slots:key") == 0
+        assert backend.acquire("key", 1, timeout=0)
+        assert not backend.acquire("key", 1, timeout=0)
+
+
+class TestExportSlot:
+    def test_global_limit(self, backend):
+        with throttle.export_slot(None, max_concurrent=1, backend=backend):
+            with pytest.raises(throttle.ExportThrottled):
+                with throttle.export_slot(None, max_concurrent=1, backend=backend):
+                    pass
+        # slot released on exit
+        with throttle.export_slot(None, max_concurrent=1, backend=backend):
+            pass
+
+    def test_user_limit(self, backend):
+        user1 = mock.Mock(pk=1, is_authenticated=True)
+        user2 = mock.Mock(pk=2, is_authenticated=True)
+        with throttle.export_slot(user1, max_per_user=1, backend=backend):
+            with throttle.export_slot(user2, max_per_user=1, backend=backend):
+                with pytest.raises(throttle.ExportThrottled):
+                    with throttle.export_slot(user1, max_per_user=1, backend=backend):
+                        pass
+
+    def test_user_limit__releases_global(self, backend):
+        user = mock.Mock(pk=1, is_authenticated=True)
+        kwargs = {"max_concurrent": 2, "max_per_user": 1, "backend": backend}
+        with throttle.export_slot(user, **kwargs):
+            with pytest.raises(throttle.ExportThrottled):
+                with throttle.export_slot(user, **kwargs):
+                    pass
+            with throttle.export_slot(AnonymousUser(), **kwargs):
+                pass
+
+    def test_user_wait__holds_no_global_slot(self, backend):
+        """Check that waiting for a per-user slot doesn't use up a global slot."""
+        user = mock.Mock(pk=1, is_authenticated=True)
+        kwargs = {"max_concurrent": 2, "max_per_user": 1, "backend": backend}
+        waiting = threading.Event()
+        acquire = backend.acquire
+
+        def _acquire(key, limit, timeout):
+            if key == "user:1" and timeout:
+                waiting.set()
+            return acquire(key, limit, timeout)
+
+        def _export():
+            with throttle.export_slot(user, timeout=5, **kwargs):
+                pass
+
+        with mock.patch.object(backend, "acquire", _acquire):
+            with throttle.export_slot(user, timeout=0, **kwargs):
+                thread = threading.Thread(target=_export)
+                thread.start()
+                assert waiting.wait(timeout=5)
+                # user's queued export holds no global slot, so this gets one
+                with throttle.export_slot(AnonymousUser(), timeout=0, **kwargs):
+                    pass
+            thread.join(timeout=5)
+        assert not thread.is_alive()
+
+    def test_release__reverse_order(self, backend):
+        user = mock.Mock(pk=1, is_authenticated=True)
+        with mock.patch.object(backend, "release") as mock_release:
+            with throttle.export_slot(
+                user, max_concurrent=1, max_per_user=1, backend=backend
+            ):
+                pass
+        assert mock_release.call_args_list == [mock.call("global"), mock.call("user:1")]
+
+    def test_unlimited(self, backend):
+        with mock.patch.object(backend, "acquire") as mock_acquire:
+            with throttle.export_slot(None, max_concurrent=None, backend=backend):
+                pass
+        assert mock_acquire.call_count == 0
+
+
+@pytest.mark.django_db
+class TestCheckRowQuota:
+    def test_under_quota(self):
+        user = User.objects.create_user("user")
+        CsvDownload.objects.create(user=user, row_count=50, filename="a.csv")
+        throttle.check_row_quota(user, quota=100, period=3600)
+
+    def test_over_quota(self):
+        user = User.objects.create_user("user")
+        CsvDownload.objects.create(user=user, row_count=50, filename="a.csv")
+        CsvDownload.objects.create(user=user, row_count=50, filename="a.csv")
+        with pytest.raises(throttle.ExportThrottled) as ex:
+            throttle.check_row_quota(user, quota=100, period=3600)
+        assert 3500 < ex.value.retry_after <= 3600
+
+    def test_outside_period(self):
+        user = User.objects.create_user("user")
+        download = CsvDownload.objects.create(
+            user=user, row_count=500, filename="a.csv"
+        )
+        download.timestamp = timezone.now() - timedelta(hours=2)
+        download.save()
+        throttle.check_row_quota(user, quota=100, period=3600)
+
+    def test_no_quota(self):
+        user = User.objects.create_user("user")
+        CsvDownload.objects.create(user=user, row_count=500, filename="a.csv")
+        throttle.check_row_quota(user, quota=None)
+
+
+@pytest.mark.django_db
+class TestCsvDownloadViewThrottling:
+    def test_row_quota(self, client):
+        user = User.objects.create_user("user")
+        CsvDownload.objects.create(user=user, row_count=500, filename="a.csv")
+        client.force_login(user)
+        check = functools.partial(throttle.check_row_quota, quota=100)
+        with mock.patch("django_csv.views.check_row_quota", check):
+            response = client.get(reverse("download_users"))
+        assert response.status_code == 429
+        assert int(response["Retry-After"]) > 0
+
+    def test_concurrency(self, client):
+        user = User.objects.create_user("user")
+        client.force_login(user)
+        backend = throttle.LocalConcurrencyBackend()
+        backend.acquire("global", 1, timeout=0)
+        slot = lambda *args, **kwargs: throttle.export_slot(
+            user, max_concurrent=1, backend=backend
+        )
+        with mock.patch("django_csv.views.export_slot", slot):
+            response = client.get(reverse("download_users"))
+        assert response.status_code == 429
+        assert response["Retry-After"] == "30"
+        backend.release("global")
+        with mock.patch("django_csv.views.export_slot", slot):
+            response = client.get(reverse("download_users"))
+        assert response.status_code == 200
@@ -1,11 +1,18 @@
+import datetime
+import io
+import zipfile
 from unittest import mock
 
 import pytest
 from django.contrib.auth.models import User
+from django.http import HttpResponse
 from django.urls import reverse
 
-from django_csv.models import CsvDownload
-from django_csv.views import download_csv
+from django_csv import csv
+from django_csv.estimate import Estimate
+from django_csv.models import CsvDownload, CsvDownloadRollup
+from django_csv.views import download_csv, download_csv_archive
+from tests.views import DownloadUsers
 
 
 @pytest.mark.django_db
@@ -40,3 +47,150 @@ class TestCsvDownloadView:
         assert response.status_code == 200
         assert response["Content-Disposition"] == 'attachment; filename="users.csv"'
         assert response["X-Row-Count"] == str(999)
+
+    @mock.patch("django_csv.views.write_csv", return_value=999)
+    @mock.patch.object(DownloadUsers, "get_statement_timeout", lambda s, r: 500)
+    @mock.patch.object(DownloadUsers, "get_using", lambda s, r: "replica")
+    def test_get__using(self, mock_write_csv, client):
+        """Check the export db alias is used for the query but not the audit."""
+        user = User.objects.create_user("user")
+        client.force_login(user)
+        response = client.get(reverse("download_users"))
+        assert response.status_code == 200
+        assert mock_write_csv.call_args.kwargs["using"] == "replica"
+        assert mock_write_csv.call_args.kwargs["statement_timeout"] == 500
+        assert CsvDownload.objects.using("default").count() == 1
+
+    @pytest.mark.parametrize("is_staff,profile", ((True, True), (False, None)))
+    @mock.patch("django_csv.views.write_csv", return_value=999)
+    def test_get__profile(self, mock_write_csv, client, is_staff, profile):
+        """Check that staff users can profile a download."""
+        user = User.objects.create_user("user", is_staff=is_staff)
+        client.force_login(user)
+        response = client.get(reverse("download_users"), {"profile": "1"})
+        assert response.status_code == 200
+        assert mock_write_csv.call_args.kwargs["profile"] is profile
+
+    @mock.patch("django_csv.views.download_csv_coalesced")
+    @mock.patch.object(DownloadUsers, "coalesce", True)
+    def test_get__coalesce(self, mock_download, client):
+        mock_download.return_value = HttpResponse()
+        user = User.objects.create_user("user")
+        client.force_login(user)
+        response = client.get(reverse("download_users"))
+        assert response.status_code == 200
+        assert mock_download.call_args.args[:3] == (
+            user,
+            "users.csv",
+            mock_download.call_args.args[2],
+        )
+        assert mock_download.call_args.args[3:] == ("first_name", "last_name")
+
+
+@pytest.mark.django_db
+def test_download_csv_archive():
+    """Check that download_csv_archive records the download once streamed."""
+    user = User.objects.create_user("user")
+    members = [
+        ("users.csv", User.objects.all(), ("first_name", "last_name")),
+        ("usernames.csv", User.objects.all(), ("username",)),
+    ]
+    response = download_csv_archive(user, "export.zip", members)
+    assert response["Content-Type"] == "application/zip"
+    assert response["Content-Disposition"] == 'attachment; filename="export.zip"'
+    assert not CsvDownload.objects.exists()
+    with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zf:
+        assert zf.namelist() == ["users.csv", "usernames.csv"]
+    download = CsvDownload.objects.get()
+    assert download.user == user
+    assert download.filename == "export.zip"
+    assert download.row_count == 2
+    assert download.columns == (
+        "users.csv: first_name, last_name; usernames.csv: username"
+    )
+
+
+@pytest.mark.django_db
+class TestCsvDownloadViewPreflight:
+    @pytest.fixture(autouse=True)
+    def login(self, client):
+        user = User.objects.create_user("user", is_staff=True)
+        client.force_login(user)
+
+    @mock.patch.object(DownloadUsers, "get_max_rows", lambda s, r: 1)
+    @mock.patch.object(DownloadUsers, "preflight", True)
+    @mock.patch.object(DownloadUsers, "reject_truncated", True)
+    def test_reject_truncated(self, client):
+        User.objects.create_user("user2")
+        response = client.get(reverse("download_users"))
+        assert response.status_code == 413
+        assert not CsvDownload.objects.exists()
+
+    @mock.patch.object(DownloadUsers, "preflight", True)
+    @mock.patch.object(DownloadUsers, "background_threshold", 0)
+    @mock.patch.object(DownloadUsers, "export_in_background")
+    def test_background(self, mock_background, client):
+        mock_background.return_value = HttpResponse(status=202)
+        response = client.get(reverse("download_users"))
+        assert response.status_code == 202
+        assert mock_background.call_args[0][1].rows == 1
+
+    @pytest.mark.parametrize(
+        "rows,writer_klass",
+        ((1, csv.BulkQuerySetWriter), (1_000_000, csv.RowQuerySetWriter)),
+    )
+    @mock.patch.object(DownloadUsers, "get_max_rows", lambda s, r: 10_000_000)
+    @mock.patch.object(DownloadUsers, "preflight", True)
+    @mock.patch.object(DownloadUsers, "writer_klass", None)
+    @mock.patch("django_csv.views.write_csv", return_value=999)
+    def test_select_writer_klass(self, mock_write_csv, client, rows, writer_klass):
+        with mock.patch("django_csv.views.estimate_export") as mock_estimate:
+            mock_estimate.return_value = Estimate(rows, 100, False, 10_000_000)
+            response = client.get(reverse("download_users"))
+        assert response.status_code == 200
+        assert mock_write_csv.call_args.kwargs["writer_klass"] == writer_klass
+
+
+@pytest.mark.django_db
+class TestCsvDownloadUsageView:
+    def test_get(self, client):
+        user = User.objects.create_user("user", is_staff=True)
+        client.force_login(user)
+        CsvDownloadRollup.objects.create(
+            date="2024-01-01", user=user, filename="users.csv", download_count=1
+        )
+        response = client.get(
+            reverse("download_usage"), {"start": "2024-01-01", "end": "2024-01-31"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["start"] == "2024-01-01"
+        assert data["totals"] == {"downloads": 1, "rows": 0, "bytes": 0}
+        assert data["daily"][0]["date"] == "2024-01-01"
+        assert data["top_users"][0]["username"] == "user"
+        assert data["top_filenames"][0]["filename"] == "users.csv"
+
+    def test_get__default_range(self, client):
+        client.force_login(User.objects.create_user("user", is_staff=True))
+        data = client.get(reverse("download_usage")).json()
+        end = datetime.date.fromisoformat(data["end"])
+        assert end - datetime.date.fromisoformat(data["start"]) == (
+            datetime.timedelta(days=29)
+        )
+
+    @pytest.mark.parametrize(
+        "params",
+        (
+            {"start": "yesterday"},
+            {"start": "2024-02-01", "end": "2024-01-01"},
+            {"start": "2020-01-01", "end": "2024-01-01"},
+        ),
+    )
+    def test_get__invalid_range(self, client, params):
+        client.force_login(User.objects.create_user("user", is_staff=True))
+        response = client.get(reverse("download_usage"), params)
+        assert response.status_code == 400
+
+    def test_get__permission(self, client):
+        client.force_login(User.objects.create_user("user"))
+        assert client.get(reverse("download_usage")).status_code == 403
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path
 
+from django_csv.views import CsvDownloadUsageView, StoredCsvDownloadView
 from tests.views import DownloadUsers
 
 admin.autodiscover()
@@ -8,4 +9,8 @@ admin.autodiscover()
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("downloads/users.csv", DownloadUsers.as_view(), name="download_users"),
+    path(
+        "downloads/<int:pk>/", StoredCsvDownloadView.as_view(), name="stored_download"
+    ),
+    path("downloads/usage/", CsvDownloadUsageView.as_view(), name="download_usage"),
 ]